@@ -2,22 +2,95 @@
 Grants API - FastAPI application
 
 Serves grant data from BigQuery with API key authentication and rate limiting.
+
+Profiling (PROFILE_ENABLED + PROFILE_TOKEN + X-Profile header) attaches to the event-loop
+thread, so a profile also contains any requests that ran concurrently on
+the same loop. Profile on an otherwise idle instance (e.g. a dedicated
+revision with max concurrency 1) for clean per-request output.
 """
 
-from fastapi import FastAPI, HTTPException, Header, Query, Depends
+from fastapi import FastAPI, HTTPException, Header, Query, Depends, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from google.cloud import bigquery
-from typing import Optional, List
+from pydantic import BaseModel, Field
+from typing import Optional, List, Dict, TYPE_CHECKING
 import os
-from datetime import datetime, timedelta
+import re
+import sys
+import math
+import bisect
+import unicodedata
+import gzip
+import decimal
+import time
+import uuid
+import cProfile
+import threading
+from collections import Counter
+from contextlib import asynccontextmanager
+from datetime import date, datetime, timedelta
 from functools import lru_cache
 import hashlib
+import hmac
+import orjson
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; fall back to gzip
+    brotli = None
+
+# google-cloud-bigquery, google-cloud-firestore and numpy are imported where
+# they are first used, keeping them off the cold-start path until warm-up.
+if TYPE_CHECKING:
+    import numpy as np
+
+
+# Startup warm-up: comma-separated steps run before the instance accepts
+# traffic (clients, catalog, funders). Empty disables warm-up.
+WARMUP_STEPS = [s.strip() for s in os.environ.get('WARMUP', 'clients').split(',') if s.strip()]
+startup_timings: Dict[str, float] = {}
+
+
+def warm_up(steps: List[str]):
+    """
+    Pay one-off costs before the first request: heavy imports, client
+    construction, authentication and (optionally) the in-memory caches.
+    Failures are logged and never block startup.
+    """
+    for step in steps:
+        start = time.perf_counter()
+        try:
+            if step == 'clients':
+                bq = get_bigquery_client()
+                project_id = os.environ.get('GCP_PROJECT', 'grants-platform-dev')
+                # Authenticates and opens a pooled connection to BigQuery
+                bq.get_dataset(f"{project_id}.grants_warehouse")
+                get_sync_generation()
+            elif step == 'catalog':
+                get_grant_catalog()
+            elif step == 'funders':
+                refresh_funders_snapshot(get_sync_generation())
+            else:
+                print(f"Unknown warm-up step: {step}")
+                continue
+        except Exception as e:
+            print(f"Warm-up step {step} failed: {e}")
+        startup_timings[step] = round((time.perf_counter() - start) * 1000, 2)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    start = time.perf_counter()
+    warm_up(WARMUP_STEPS)
+    startup_timings['total'] = round((time.perf_counter() - start) * 1000, 2)
+    print(f"Startup warm-up complete: {startup_timings}")
+    yield
 
 
 app = FastAPI(
     title="Grants Intelligence API",
     description="Ontario nonprofit grants discovery and filtering API",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # CORS middleware
@@ -29,6 +102,324 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Response compression
+COMPRESSION_MIN_SIZE = int(os.environ.get('COMPRESSION_MIN_SIZE', '1024'))
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+
+def choose_encoding(accept_encoding: str) -> Optional[str]:
+    """Pick the best supported content-coding from an Accept-Encoding header."""
+    accepted = {}
+    for part in accept_encoding.split(','):
+        coding, _, params = part.strip().partition(';')
+        q = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[coding.strip().lower()] = q
+    
+    for coding in (('br', 'gzip') if brotli else ('gzip',)):
+        if accepted.get(coding, accepted.get('*', 0)) > 0:
+            return coding
+    return None
+
+
+class CompressionMiddleware:
+    """
+    Negotiated brotli/gzip compression for responses above COMPRESSION_MIN_SIZE.
+    
+    Unlike Starlette's GZipMiddleware this also offers brotli, which is
+    noticeably smaller on repetitive JSON such as grant listings.
+    """
+    
+    def __init__(self, app, minimum_size: int = COMPRESSION_MIN_SIZE):
+        self.app = app
+        self.minimum_size = minimum_size
+    
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+        
+        headers = dict(scope.get('headers') or [])
+        encoding = choose_encoding(headers.get(b'accept-encoding', b'').decode('latin-1'))
+        if encoding is None:
+            return await self.app(scope, receive, send)
+        
+        start_message = None
+        body = []
+        
+        async def buffered_send(message):
+            nonlocal start_message
+            if message['type'] == 'http.response.start':
+                start_message = message
+                return
+            if message['type'] != 'http.response.body':
+                return await send(message)
+            
+            body.append(message.get('body', b''))
+            if message.get('more_body', False):
+                return
+            
+            payload = b''.join(body)
+            response_headers = [(k, v) for k, v in start_message['headers'] if k.lower() != b'content-length']
+            already_encoded = any(k.lower() == b'content-encoding' for k, _ in response_headers)
+            if len(payload) >= self.minimum_size and not already_encoded:
+                if encoding == 'br':
+                    payload = brotli.compress(payload, quality=BROTLI_QUALITY)
+                else:
+                    payload = gzip.compress(payload, compresslevel=GZIP_LEVEL)
+                response_headers.append((b'content-encoding', encoding.encode()))
+                response_headers.append((b'vary', b'Accept-Encoding'))
+            response_headers.append((b'content-length', str(len(payload)).encode()))
+            
+            await send({**start_message, 'headers': response_headers})
+            await send({'type': 'http.response.body', 'body': payload})
+        
+        await self.app(scope, receive, buffered_send)
+
+
+app.add_middleware(CompressionMiddleware)
+
+
+# Fast-path JSON serialization: BigQuery rows are encoded straight to bytes
+# with orjson, bypassing FastAPI's jsonable_encoder walk.
+def _json_default(obj):
+    if isinstance(obj, decimal.Decimal):
+        return float(obj)
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+
+def rows_to_dicts(rows) -> List[dict]:
+    """Convert BigQuery Rows to dicts, resolving field names once per result."""
+    rows = list(rows)
+    if not rows:
+        return []
+    keys = list(rows[0].keys())
+    return [dict(zip(keys, row.values())) for row in rows]
+
+
+def json_response(content, status_code: int = 200) -> Response:
+    """Serialize `content` with orjson and return it as a ready-made response."""
+    return Response(
+        content=orjson.dumps(content, default=_json_default),
+        status_code=status_code,
+        media_type='application/json',
+    )
+
+
+# Profiling (opt-in): set PROFILE_ENABLED=1 and PROFILE_TOKEN, then send
+# `X-Profile: sample` or `X-Profile: cprofile` with `X-Profile-Token` on a
+# request to write a profile to PROFILE_DIR. Only the newest
+# PROFILE_MAX_FILES profiles are kept.
+PROFILE_ENABLED = os.environ.get('PROFILE_ENABLED', '').lower() in ('1', 'true', 'yes')
+PROFILE_TOKEN = os.environ.get('PROFILE_TOKEN', '')
+PROFILE_DIR = os.environ.get('PROFILE_DIR', '/tmp/profiles')
+PROFILE_MAX_FILES = int(os.environ.get('PROFILE_MAX_FILES', '20'))
+PROFILE_SAMPLE_INTERVAL = float(os.environ.get('PROFILE_SAMPLE_INTERVAL', '0.005'))
+_profile_lock = threading.Lock()
+
+
+# Deployed separately from the sync function, so StackSampler is duplicated
+# there; test_stack_sampler_matches_sync_copy keeps the two identical.
+class StackSampler:
+    """
+    Samples one thread's stack on a timer and counts identical stacks.
+    
+    Use as a context manager around the code to profile; by default the
+    sampled thread is the one entering the context. `write` produces
+    collapsed stacks (one `frame;frame;frame count` line per stack), which
+    flamegraph.pl and speedscope render directly.
+    """
+    
+    def __init__(self, interval: float = 0.005, thread_id: Optional[int] = None):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+    
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+    
+    def __enter__(self):
+        if self.thread_id is None:
+            self.thread_id = threading.get_ident()
+        self._thread.start()
+        return self
+    
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+    
+    def write(self, path: str):
+        with open(path, 'w') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+def profile_output_path(name: str, extension: str) -> str:
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    return os.path.join(PROFILE_DIR, f"{name}-{int(time.time())}-{uuid.uuid4().hex[:8]}.{extension}")
+
+
+def prune_profiles():
+    """Delete all but the newest PROFILE_MAX_FILES profiles; PROFILE_DIR is usually in-memory."""
+    paths = [os.path.join(PROFILE_DIR, name) for name in os.listdir(PROFILE_DIR)]
+    paths.sort(key=os.path.getmtime, reverse=True)
+    for path in paths[PROFILE_MAX_FILES:]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def profile_authorized(request: Request) -> bool:
+    """Profiling needs PROFILE_TOKEN configured and echoed in X-Profile-Token."""
+    token = request.headers.get('x-profile-token', '')
+    return bool(PROFILE_TOKEN) and hmac.compare_digest(token.encode(), PROFILE_TOKEN.encode())
+
+
+@app.middleware("http")
+async def profile_request(request: Request, call_next):
+    """
+    Profile a request when profiling is enabled and the X-Profile header is set.
+    
+    Both profilers observe the whole event-loop thread while the request is
+    in flight, so concurrent requests on this loop are included in the dump.
+    """
+    mode = request.headers.get('x-profile')
+    if not PROFILE_ENABLED or not mode or not profile_authorized(request):
+        return await call_next(request)
+    
+    # Only one profiler can be attached at a time
+    if not _profile_lock.acquire(blocking=False):
+        return await call_next(request)
+    
+    try:
+        name = request.url.path.strip('/').replace('/', '_') or 'root'
+        if mode == 'cprofile':
+            profiler = cProfile.Profile()
+            profiler.enable()
+            try:
+                response = await call_next(request)
+            finally:
+                profiler.disable()
+            path = profile_output_path(name, 'prof')
+            profiler.dump_stats(path)
+        else:
+            with StackSampler(PROFILE_SAMPLE_INTERVAL) as sampler:
+                response = await call_next(request)
+            path = profile_output_path(name, 'folded')
+            sampler.write(path)
+        prune_profiles()
+    finally:
+        _profile_lock.release()
+    
+    response.headers['X-Profile-Output'] = os.path.basename(path)
+    return response
+
+
+# HTTP caching: ETags are derived from the sync generation (metadata/sync
+# last_sync_time), so cached responses stay valid until the next sync.
+SYNC_GENERATION_TTL = float(os.environ.get('SYNC_GENERATION_TTL', '30'))
+CACHE_MAX_AGE = int(os.environ.get('CACHE_MAX_AGE', '60'))
+CDN_MAX_AGE = int(os.environ.get('CDN_MAX_AGE', '300'))
+_sync_generation = {'value': None, 'fetched_at': 0.0}
+
+
+def get_sync_generation() -> Optional[str]:
+    """
+    Return the current sync generation, re-reading Firestore at most once
+    every SYNC_GENERATION_TTL seconds. Returns None if it can't be read.
+    """
+    now = time.monotonic()
+    if _sync_generation['fetched_at'] and now - _sync_generation['fetched_at'] < SYNC_GENERATION_TTL:
+        return _sync_generation['value']
+    
+    # Failed reads also wait out the TTL, so an outage doesn't add latency to every request
+    _sync_generation['fetched_at'] = now
+    try:
+        sync_doc = get_firestore_client().collection('metadata').document('sync').get()
+    except Exception as e:
+        print(f"Could not read sync generation: {e}")
+        return _sync_generation['value']
+    
+    last_sync = sync_doc.to_dict().get('last_sync_time') if sync_doc.exists else None
+    _sync_generation['value'] = last_sync.isoformat() if last_sync else None
+    return _sync_generation['value']
+
+
+def compute_etag(request: Request, generation: str) -> str:
+    """Weak ETag over the sync generation, the current date and the normalized query."""
+    query = '&'.join(f"{k}={v}" for k, v in sorted(request.query_params.multi_items()))
+    tier = 'keyed' if request.headers.get('x-api-key') else 'public'
+    key = '|'.join([generation, datetime.now().date().isoformat(), request.url.path, query, tier])
+    return f'W/"{hashlib.sha256(key.encode()).hexdigest()[:32]}"'
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    opaque = etag[2:]
+    for candidate in if_none_match.split(','):
+        candidate = candidate.strip()
+        if candidate == '*' or candidate.removeprefix('W/') == opaque:
+            return True
+    return False
+
+
+def merge_vary(existing: Optional[str], tokens: List[str]) -> str:
+    """Add `tokens` to an existing Vary header value, keeping what is already there."""
+    values = [v.strip() for v in (existing or '').split(',') if v.strip()]
+    seen = {v.lower() for v in values}
+    values += [t for t in tokens if t.lower() not in seen]
+    return ', '.join(values)
+
+
+@app.middleware("http")
+async def conditional_get(request: Request, call_next):
+    """
+    Answer If-None-Match with 304 before any BigQuery work, and tag
+    successful API responses with ETag / Cache-Control.
+    """
+    if request.method not in ('GET', 'HEAD') or not request.url.path.startswith('/api/'):
+        return await call_next(request)
+    
+    generation = get_sync_generation()
+    if generation is None:
+        return await call_next(request)
+    
+    etag = compute_etag(request, generation)
+    # Credentialed requests get a reflected CORS origin, which a shared cache must not reuse
+    credentialed = any(request.headers.get(h) for h in ('x-api-key', 'cookie', 'authorization'))
+    if credentialed:
+        cache_control = f"private, max-age={CACHE_MAX_AGE}"
+    else:
+        cache_control = f"public, max-age={CACHE_MAX_AGE}, s-maxage={CDN_MAX_AGE}"
+    headers = {'ETag': etag, 'Cache-Control': cache_control}
+    vary = ['X-API-Key', 'Accept-Encoding', 'Origin']
+    
+    if_none_match = request.headers.get('if-none-match')
+    if if_none_match and etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers={**headers, 'Vary': merge_vary(None, vary)})
+    
+    response = await call_next(request)
+    if response.status_code == 200:
+        response.headers.update(headers)
+        response.headers['Vary'] = merge_vary(response.headers.get('vary'), vary)
+    return response
+
+
 # API Tier Configuration (from Terraform variables)
 API_TIERS = {
     'free': {'daily_quota': 100, 'description': 'Free tier'},
@@ -41,9 +432,360 @@ API_TIERS = {
 @lru_cache()
 def get_bigquery_client():
     """Cached BigQuery client."""
+    from google.cloud import bigquery
     return bigquery.Client()
 
 
+@lru_cache()
+def get_firestore_client():
+    """Cached Firestore client (sync metadata only)."""
+    from google.cloud import firestore
+    return firestore.Client()
+
+
+# Funder aggregates, pre-serialized once per sync generation
+_funders_snapshot = {'generation': None, 'body': None}
+
+
+def load_funders_snapshot() -> Optional[List[dict]]:
+    """Read the funder aggregates written by the sync, ordered by open grants."""
+    doc = get_firestore_client().collection('metadata').document('funders_activity').get()
+    if not doc.exists:
+        return None
+    funders = list((doc.to_dict() or {}).get('funders', {}).values())
+    funders.sort(key=lambda f: f.get('open_grants') or 0, reverse=True)
+    return funders
+
+
+def refresh_funders_snapshot(generation: Optional[str]) -> Optional[bytes]:
+    """
+    Load and pre-serialize the funder aggregates, caching the body for
+    `generation`. Returns None if the sync hasn't written a snapshot yet.
+    """
+    funders = load_funders_snapshot()
+    if funders is None:
+        return None
+    body = orjson.dumps({'funders': funders}, default=_json_default)
+    if generation is not None:
+        _funders_snapshot.update(generation=generation, body=body)
+    return body
+
+
+# Full-text search. Term frequencies are computed by the sync (title terms
+# boosted); tokenize() must match the sync function's tokenizer, which
+# test_query_tokenizer_matches_sync_index_tokenizer enforces.
+BM25_K1 = 1.2
+BM25_B = 0.75
+SEARCH_PREFIX_WEIGHT = 0.7
+SEARCH_MAX_PREFIX_EXPANSIONS = 50
+SEARCH_STOPWORDS = frozenset(
+    'a an and are as at be by for from in into is it of on or that the to with '
+    'au aux de des du en et la le les ou pour sur un une'.split()
+)
+_TOKEN_RE = re.compile(r'[a-z0-9]+')
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase, strip accents and split into alphanumeric search tokens."""
+    text = unicodedata.normalize('NFKD', text.lower())
+    text = ''.join(ch for ch in text if not unicodedata.combining(ch))
+    return [t for t in _TOKEN_RE.findall(text) if len(t) > 1 and t not in SEARCH_STOPWORDS]
+
+
+class GrantCatalog:
+    """
+    In-memory copy of the open grants in grants_flat with an inverted index
+    over the sync-computed search terms. Rows the sync hasn't given terms
+    yet are counted in `unindexed`; they never match a keyword search.
+    """
+    
+    def __init__(self, rows: List[dict]):
+        self.grants = []
+        self.postings: Dict[str, List[tuple]] = {}
+        self.unindexed = 0
+        lengths = []
+        for doc_id, row in enumerate(rows):
+            terms = row.pop('search_terms', None) or []
+            if not terms:
+                self.unindexed += 1
+            lengths.append(row.pop('search_length', None) or 0)
+            self.grants.append(row)
+            for entry in terms:
+                self.postings.setdefault(entry['term'], []).append((doc_id, entry['tf']))
+        
+        self.doc_lengths = lengths
+        self.avg_length = (sum(lengths) / len(lengths)) if lengths else 0
+        self.vocabulary = sorted(self.postings)
+        self.eligibility = EligibilityIndex(self.grants)
+    
+    def _expand(self, token: str) -> List[tuple]:
+        """Index terms matching `token` exactly or by prefix, with their weights."""
+        matches = [(token, 1.0)] if token in self.postings else []
+        start = bisect.bisect_left(self.vocabulary, token)
+        for term in self.vocabulary[start:start + SEARCH_MAX_PREFIX_EXPANSIONS + 1]:
+            if not term.startswith(token):
+                break
+            if term != token:
+                matches.append((term, SEARCH_PREFIX_WEIGHT))
+        return matches
+    
+    def search(self, query: str) -> Dict[int, float]:
+        """BM25 scores by document position for every grant matching `query`."""
+        total = len(self.grants)
+        scores: Dict[int, float] = {}
+        for token in set(tokenize(query)):
+            best: Dict[int, float] = {}
+            for term, weight in self._expand(token):
+                postings = self.postings[term]
+                idf = math.log(1 + (total - len(postings) + 0.5) / (len(postings) + 0.5))
+                for doc_id, tf in postings:
+                    norm = 1 - BM25_B + BM25_B * (self.doc_lengths[doc_id] / self.avg_length if self.avg_length else 1)
+                    score = weight * idf * tf * (BM25_K1 + 1) / (tf + BM25_K1 * norm)
+                    if score > best.get(doc_id, 0):
+                        best[doc_id] = score
+            for doc_id, score in best.items():
+                scores[doc_id] = scores.get(doc_id, 0) + score
+        return scores
+
+
+class OrgProfile(BaseModel):
+    """An organization profile to match against grant eligibility rules."""
+    org_type: Optional[str] = Field(None, description="Organization type (e.g., charity, nonprofit)")
+    years_active: Optional[int] = Field(None, ge=0, description="Years the organization has operated")
+    annual_revenue: Optional[int] = Field(None, ge=0, description="Annual revenue in CAD")
+    registered: Optional[bool] = Field(None, description="Registered charity / incorporated")
+    province: Optional[str] = Field(None, description="Province code (e.g., ON)")
+    city: Optional[str] = Field(None, description="City")
+    include_ineligible: bool = Field(False, description="Also return grants that fail a rule")
+    limit: int = Field(50, ge=1, le=100, description="Maximum matches to return")
+
+
+MATCH_RULES = ('org_type', 'years_active', 'revenue', 'registered', 'province', 'city')
+RULE_PASS, RULE_FAIL, RULE_UNKNOWN = 'pass', 'fail', 'unknown'
+DEADLINE_KEY_SPAN = date.max.toordinal() + 1
+
+
+def _codes(values: List[Optional[str]]) -> tuple:
+    """Factorize strings (case-insensitive) into int codes; None becomes -1."""
+    import numpy as np
+    vocab: Dict[str, int] = {}
+    codes = np.array([vocab.setdefault(v.lower(), len(vocab)) if v else -1 for v in values], dtype=np.int32)
+    return codes, vocab
+
+
+class EligibilityIndex:
+    """
+    Columnar view of the catalogue's eligibility fields.
+    
+    Each rule is evaluated for every grant at once with numpy; only the
+    returned matches are turned back into per-rule reasons.
+    """
+    
+    def __init__(self, grants: List[dict]):
+        import numpy as np
+        n = len(grants)
+        self.grants = grants
+        self.open = np.array([g.get('status') == 'open' for g in grants], dtype=bool)
+        self.deadline = np.array(
+            [g['deadline_close'].toordinal() if g.get('deadline_close') else date.max.toordinal() for g in grants],
+            dtype=np.int64
+        )
+        self.years_min = np.array(
+            [g['years_active_min'] if g.get('years_active_min') is not None else np.nan for g in grants], dtype=float
+        )
+        self.revenue_max = np.array(
+            [g['revenue_max'] if g.get('revenue_max') is not None else np.nan for g in grants], dtype=float
+        )
+        self.registered_required = np.array([bool(g.get('registered_required')) for g in grants], dtype=bool)
+        self.province, self.province_vocab = _codes([g.get('province') for g in grants])
+        self.city, self.city_vocab = _codes([g.get('city') for g in grants])
+        
+        # One boolean column per organization type; grants with no list accept any type
+        self.org_type_vocab: Dict[str, int] = {}
+        for g in grants:
+            for t in g.get('eligible_org_types') or []:
+                self.org_type_vocab.setdefault(t.lower(), len(self.org_type_vocab))
+        self.org_types = np.zeros((n, len(self.org_type_vocab)), dtype=bool)
+        for i, g in enumerate(grants):
+            for t in g.get('eligible_org_types') or []:
+                self.org_types[i, self.org_type_vocab[t.lower()]] = True
+        self.org_type_open = ~self.org_types.any(axis=1) if n else np.zeros(0, dtype=bool)
+        
+        self.years_constrained = ~np.isnan(self.years_min)
+        self.revenue_constrained = ~np.isnan(self.revenue_max)
+        self.years_min = np.nan_to_num(self.years_min)
+        self.revenue_max = np.nan_to_num(self.revenue_max)
+        
+        # Each grant's requirement per rule (in MATCH_RULES order), reported with the reasons
+        self.requirements = [(
+            g.get('eligible_org_types') or None,
+            g.get('years_active_min'),
+            g.get('revenue_max'),
+            g.get('registered_required') or None,
+            g.get('province'),
+            g.get('city'),
+        ) for g in grants]
+    
+    def evaluate(self, profile: OrgProfile) -> Dict[str, tuple]:
+        """Return (passed, constrained) boolean arrays for each rule."""
+        import numpy as np
+        n = len(self.grants)
+        unknown = np.zeros(n, dtype=bool)
+        rules = {}
+        
+        if profile.org_type is None:
+            rules['org_type'] = (unknown, ~self.org_type_open)
+        else:
+            column = self.org_type_vocab.get(profile.org_type.lower())
+            accepted = self.org_types[:, column] if column is not None else np.zeros(n, dtype=bool)
+            rules['org_type'] = (self.org_type_open | accepted, ~self.org_type_open)
+        
+        if profile.years_active is None:
+            rules['years_active'] = (unknown, self.years_constrained)
+        else:
+            rules['years_active'] = (~self.years_constrained | (profile.years_active >= self.years_min),
+                                     self.years_constrained)
+        
+        if profile.annual_revenue is None:
+            rules['revenue'] = (unknown, self.revenue_constrained)
+        else:
+            rules['revenue'] = (~self.revenue_constrained | (profile.annual_revenue <= self.revenue_max),
+                                self.revenue_constrained)
+        
+        if profile.registered is None:
+            rules['registered'] = (unknown, self.registered_required)
+        else:
+            rules['registered'] = (~self.registered_required | profile.registered, self.registered_required)
+        
+        for rule, codes, vocab, value in (
+            ('province', self.province, self.province_vocab, profile.province),
+            ('city', self.city, self.city_vocab, profile.city),
+        ):
+            constrained = codes >= 0
+            if value is None:
+                rules[rule] = (unknown, constrained)
+            else:
+                rules[rule] = (~constrained | (codes == vocab.get(value.lower(), -2)), constrained)
+        
+        return rules
+    
+    def match(self, profile: OrgProfile, today: date) -> List[dict]:
+        """Rank open grants for `profile`, with per-rule reasons."""
+        import numpy as np
+        if not self.grants:
+            return []
+        
+        rules = self.evaluate(profile)
+        known = self._known(profile)[:, None]
+        passed = np.stack([rules[r][0] for r in MATCH_RULES])
+        constrained = np.stack([rules[r][1] for r in MATCH_RULES])
+        failed = constrained & ~passed & known
+        unknown = constrained & ~known
+        
+        available = self.open & (self.deadline >= today.toordinal())
+        eligible = available & ~failed.any(axis=0)
+        candidates = available if profile.include_ineligible else eligible
+        
+        # More satisfied constraints rank higher; unknowns and failures lower; then soonest deadline
+        score = (constrained & passed).sum(axis=0) - 0.5 * unknown.sum(axis=0) - 2.0 * failed.sum(axis=0)
+        indices = np.flatnonzero(candidates)
+        
+        # Scores are multiples of 0.5, so score and deadline fold into one integer sort key
+        key = (-2 * score[indices]).astype(np.int64) * DEADLINE_KEY_SPAN + self.deadline[indices]
+        if len(indices) > profile.limit:
+            top = np.argpartition(key, profile.limit)[:profile.limit]
+        else:
+            top = np.arange(len(indices))
+        selected = indices[top[np.argsort(key[top], kind='stable')]]
+        
+        # Per-rule status (0 pass, 1 fail, 2 unknown) for the selected grants only
+        status = (failed[:, selected] + 2 * unknown[:, selected]).T.tolist()
+        labels = (RULE_PASS, RULE_FAIL, RULE_UNKNOWN)
+        
+        matches = []
+        for i, rule_status, grant_score, grant_eligible in zip(
+            selected.tolist(), status, score[selected].tolist(), eligible[selected].tolist()
+        ):
+            matches.append({
+                'grant': self.grants[i],
+                'eligible': grant_eligible,
+                'score': float(grant_score),
+                'reasons': {
+                    rule: {'status': labels[code], 'requirement': requirement}
+                    for rule, code, requirement in zip(MATCH_RULES, rule_status, self.requirements[i])
+                },
+            })
+        return matches
+    
+    @staticmethod
+    def _known(profile: OrgProfile) -> 'np.ndarray':
+        import numpy as np
+        return np.array([
+            profile.org_type is not None,
+            profile.years_active is not None,
+            profile.annual_revenue is not None,
+            profile.registered is not None,
+            profile.province is not None,
+            profile.city is not None,
+        ], dtype=bool)
+
+
+# Grant catalogue, reloaded once per sync generation
+_grant_catalog = {'generation': None, 'catalog': None}
+
+
+def load_grant_catalog() -> GrantCatalog:
+    """Load open and rolling grants from grants_flat into a GrantCatalog."""
+    bq = get_bigquery_client()
+    project_id = os.environ.get('GCP_PROJECT', 'grants-platform-dev')
+    query = f"""
+    SELECT * FROM `{project_id}.grants_warehouse.grants_flat`
+    WHERE deadline_close >= CURRENT_DATE() OR deadline_close IS NULL
+    """
+    catalog = GrantCatalog(rows_to_dicts(bq.query(query).result()))
+    if catalog.unindexed:
+        # Rows written before search terms existed; a backfill fills them in
+        print(f"Grant catalog: {catalog.unindexed} of {len(catalog.grants)} grants have no search terms "
+              f"and are missing from keyword search; run the sync with ?mode=backfill")
+    return catalog
+
+
+def get_grant_catalog() -> GrantCatalog:
+    generation = get_sync_generation()
+    if _grant_catalog['catalog'] is None or (generation is not None and _grant_catalog['generation'] != generation):
+        _grant_catalog.update(generation=generation, catalog=load_grant_catalog())
+    return _grant_catalog['catalog']
+
+
+def grant_matches_filters(
+    grant: dict,
+    province: Optional[str] = None,
+    category: Optional[str] = None,
+    min_amount: Optional[int] = None,
+    max_amount: Optional[int] = None,
+    status: Optional[str] = None,
+    deadline_cutoff: Optional[date] = None,
+    today: Optional[date] = None
+) -> bool:
+    """In-process equivalent of the structured filters in search_grants."""
+    deadline_close = grant.get('deadline_close')
+    if province and grant.get('province') != province:
+        return False
+    if category and not any(category.lower() in (c or '').lower() for c in grant.get('categories') or []):
+        return False
+    if min_amount and (grant.get('max_amount') is None or grant['max_amount'] < min_amount):
+        return False
+    if max_amount and (grant.get('min_amount') is None or grant['min_amount'] > max_amount):
+        return False
+    if status and grant.get('status') != status:
+        return False
+    if deadline_cutoff and (deadline_close is None or deadline_close > deadline_cutoff):
+        return False
+    if today and deadline_close is not None and deadline_close < today:
+        return False
+    return True
+
+
 # Dependency: API Key Validation
 async def validate_api_key(x_api_key: Optional[str] = Header(None)):
     """
@@ -81,6 +823,7 @@ async def search_grants(
     max_amount: Optional[int] = Query(None, description="Maximum grant amount"),
     status: Optional[str] = Query('open', description="Grant status"),
     max_deadline_days: Optional[int] = Query(None, description="Deadline within N days"),
+    q: Optional[str] = Query(None, description="Keyword search over title, summary and eligibility"),
     limit: int = Query(50, le=100, description="Results per page"),
     offset: int = Query(0, description="Pagination offset"),
     auth: dict = Depends(validate_api_key)
@@ -88,19 +831,27 @@ async def search_grants(
     """
     Search and filter grants.
     
+    With `q`, grants are ranked by relevance using the in-memory search
+    index; the other filters still apply.
+    
     Public Tier: Returns only top 5 results, ignores offset/limit.
     """
-    bq = get_bigquery_client()
-    project_id = os.environ.get('GCP_PROJECT', 'grants-platform-dev')
-    
     # Enforce public tier limits
     if auth['tier'] == 'public':
         limit = 5
         offset = 0
+    
+    if q:
+        return keyword_search(q, province, category, min_amount, max_amount, status,
+                              max_deadline_days, limit, offset, auth['tier'])
+    
+    from google.cloud import bigquery
+    bq = get_bigquery_client()
+    project_id = os.environ.get('GCP_PROJECT', 'grants-platform-dev')
 
     # Build query dynamically
     query_parts = [
-        f"SELECT *, count(*) OVER() as total_rows FROM `{project_id}.grants_warehouse.grants_flat`",
+        f"SELECT * EXCEPT (search_terms, search_length), count(*) OVER() as total_rows FROM `{project_id}.grants_warehouse.grants_flat`",
         "WHERE 1=1"
     ]
     params = []
@@ -148,22 +899,84 @@ async def search_grants(
         query_job = bq.query(query, job_config=job_config)
         results = list(query_job.result())
         
-        grants = [dict(row) for row in results]
+        grants = rows_to_dicts(results)
         # Remove the window function helper from individual rows but keep the count
         total_count = results[0]['total_rows'] if results else 0
         for g in grants:
             g.pop('total_rows', None)
         
-        return {
+        return json_response({
             'grants': grants,
             'count': len(grants),
             'total_count': total_count,
             'limit': limit,
             'offset': offset,
             'tier': auth['tier']
-        }
+        })
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Query failed: {str(e)}")
+
+
+def keyword_search(q, province, category, min_amount, max_amount, status,
+                   max_deadline_days, limit, offset, tier):
+    """Relevance-ranked search served entirely from the grant catalogue."""
+    try:
+        catalog = get_grant_catalog()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Query failed: {str(e)}")
+    
+    today = datetime.now().date()
+    deadline_cutoff = today + timedelta(days=max_deadline_days) if max_deadline_days else None
+    scores = catalog.search(q)
+    matches = [
+        (score, catalog.grants[doc_id]) for doc_id, score in scores.items()
+        if grant_matches_filters(catalog.grants[doc_id], province, category, min_amount, max_amount,
+                                 status, deadline_cutoff, today)
+    ]
+    matches.sort(key=lambda m: (-m[0], m[1].get('deadline_close') or date.max))
+    
+    grants = []
+    for score, grant in matches[offset:offset + limit]:
+        grants.append({**grant, 'relevance': round(score, 4)})
+    
+    return json_response({
+        'grants': grants,
+        'count': len(grants),
+        'total_count': len(matches),
+        'limit': limit,
+        'offset': offset,
+        'tier': tier
+    })
+
+
+@app.post("/api/v1/match")
+async def match_grants(
+    profile: OrgProfile,
+    auth: dict = Depends(validate_api_key)
+):
+    """
+    Match an organization profile against every open grant.
+    
+    Returns grants ranked by how well the profile satisfies their
+    eligibility rules, with the outcome of each rule. Profile fields left
+    out are reported as `unknown` rather than failing.
+    
+    Public Tier: Returns only top 5 matches.
+    """
+    if auth['tier'] == 'public':
+        profile.limit = min(profile.limit, 5)
+    
+    try:
+        catalog = get_grant_catalog()
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Query failed: {str(e)}")
+    
+    matches = catalog.eligibility.match(profile, datetime.now().date())
+    return json_response({
+        'matches': matches,
+        'count': len(matches),
+        'tier': auth['tier']
+    })
 
 
 @app.get("/api/v1/grants/{grant_id}")
@@ -172,11 +985,12 @@ async def get_grant(
     auth: dict = Depends(validate_api_key)
 ):
     """Get a single grant by ID."""
+    from google.cloud import bigquery
     bq = get_bigquery_client()
     project_id = os.environ.get('GCP_PROJECT', 'grants-platform-dev')
     
     query = f"""
-    SELECT * FROM `{project_id}.grants_warehouse.grants_flat`
+    SELECT * EXCEPT (search_terms, search_length) FROM `{project_id}.grants_warehouse.grants_flat`
     WHERE grant_id = @grant_id
     AND deadline_close >= CURRENT_DATE()
     LIMIT 1
@@ -195,7 +1009,7 @@ async def get_grant(
         if not results:
             raise HTTPException(status_code=404, detail="Grant not found")
         
-        return dict(results[0])
+        return json_response(rows_to_dicts(results)[0])
     except HTTPException:
         raise
     except Exception as e:
@@ -206,7 +1020,26 @@ async def get_grant(
 async def list_funders(
     auth: dict = Depends(validate_api_key)
 ):
-    """List active funders with grant counts."""
+    """
+    List active funders with grant counts.
+    
+    Served from an in-memory snapshot of the aggregates the sync keeps in
+    metadata/funders_activity, reloaded when the sync generation changes.
+    Falls back to the funders_activity table if no snapshot exists yet.
+    """
+    generation = get_sync_generation()
+    if generation is not None and _funders_snapshot['generation'] == generation:
+        return Response(content=_funders_snapshot['body'], media_type='application/json')
+    
+    try:
+        body = refresh_funders_snapshot(generation)
+    except Exception as e:
+        print(f"Could not load funders snapshot: {e}")
+        body = None
+    
+    if body is not None:
+        return Response(content=body, media_type='application/json')
+    
     bq = get_bigquery_client()
     project_id = os.environ.get('GCP_PROJECT', 'grants-platform-dev')
     
@@ -219,8 +1052,8 @@ async def list_funders(
         query_job = bq.query(query)
         results = query_job.result()
         
-        funders = [dict(row) for row in results]
-        return {'funders': funders}
+        funders = rows_to_dicts(results)
+        return json_response({'funders': funders})
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Query failed: {str(e)}")
 
@@ -231,6 +1064,7 @@ async def upcoming_deadlines(
     auth: dict = Depends(validate_api_key)
 ):
     """Get upcoming grant deadlines calendar."""
+    from google.cloud import bigquery
     bq = get_bigquery_client()
     project_id = os.environ.get('GCP_PROJECT', 'grants-platform-dev')
     
@@ -256,8 +1090,8 @@ async def upcoming_deadlines(
         query_job = bq.query(query, job_config=job_config)
         results = query_job.result()
         
-        deadlines = [dict(row) for row in results]
-        return {'deadlines': deadlines}
+        deadlines = rows_to_dicts(results)
+        return json_response({'deadlines': deadlines})
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Query failed: {str(e)}")
 
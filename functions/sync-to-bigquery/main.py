@@ -6,30 +6,267 @@ Denormalizes Firestore grants data and upserts to BigQuery grants_flat table.
 """
 
 import os
-from datetime import datetime, timezone
-from typing import Dict, List, Any
+import re
+import sys
+import json
+import hashlib
+import unicodedata
+import time
+import uuid
+import cProfile
+import threading
+import multiprocessing
+import urllib.parse
+import urllib.request
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta, timezone
+from typing import Dict, List, Any, Optional, Set
 import functions_framework
 from google.cloud import firestore
 from google.cloud import bigquery
+from google.api_core.exceptions import Conflict, FailedPrecondition
 
 
-def get_last_sync_time(db: firestore.Client) -> datetime:
-    """Get the last successful sync timestamp from Firestore metadata."""
-    sync_doc = db.collection('metadata').document('sync').get()
+# Full-text search: title terms are counted SEARCH_TITLE_BOOST times so
+# BM25 at query time favours title matches. The API tokenizes queries with
+# the same rules (see tokenize() in api/main.py; kept in step by
+# test_query_tokenizer_matches_sync_index_tokenizer).
+SEARCH_TITLE_BOOST = 3
+SEARCH_STOPWORDS = frozenset(
+    'a an and are as at be by for from in into is it of on or that the to with '
+    'au aux de des du en et la le les ou pour sur un une'.split()
+)
+_TOKEN_RE = re.compile(r'[a-z0-9]+')
+
+# Firestore batches are limited to 500 writes
+FIRESTORE_BATCH_SIZE = 500
+
+# Backfill: ?mode=backfill rebuilds grants_flat from every grant, split into
+# document-ID range shards. Shards run in local worker processes
+# (executor=process) or as separate invocations of this function
+# (executor=fanout, calling BACKFILL_SHARD_URL with ?mode=backfill_shard).
+BACKFILL_SHARDS = int(os.environ.get('BACKFILL_SHARDS', '8'))
+BACKFILL_WORKERS = int(os.environ.get('BACKFILL_WORKERS', str(os.cpu_count() or 1)))
+BACKFILL_EXECUTOR = os.environ.get('BACKFILL_EXECUTOR', 'process')
+BACKFILL_SHARD_URL = os.environ.get('BACKFILL_SHARD_URL')
+BACKFILL_SHARD_TIMEOUT = int(os.environ.get('BACKFILL_SHARD_TIMEOUT', '3600'))
+# While a backfill runs it holds a lease in metadata/sync; hourly syncs skip
+# until it is released or expires.
+BACKFILL_LEASE_SECONDS = int(os.environ.get('BACKFILL_LEASE_SECONDS', str(2 * BACKFILL_SHARD_TIMEOUT)))
+
+# Profiling: pass ?profile=sample or ?profile=cprofile (or set SYNC_PROFILE)
+# to write a profile of the run to SYNC_PROFILE_DIR.
+SYNC_PROFILE_DIR = os.environ.get('SYNC_PROFILE_DIR', '/tmp/profiles')
+SYNC_PROFILE_INTERVAL = float(os.environ.get('SYNC_PROFILE_INTERVAL', '0.005'))
+
+
+def log_event(message: str, severity: str = 'INFO', **fields):
+    """
+    Emit a structured log line.
+
+    Cloud Functions parses JSON written to stdout into structured log entries,
+    so `severity` and any extra fields become queryable in Cloud Logging.
+    """
+    print(json.dumps({'severity': severity, 'message': message, **fields}, default=str))
+
+
+def new_counters() -> Dict[str, int]:
+    """Firestore read / round-trip counters threaded through the pipeline."""
+    return {'firestore_reads': 0, 'firestore_round_trips': 0}
+
+
+def _count_reads(counters: Optional[Dict[str, int]], reads: int, round_trips: int = 1):
+    if counters is not None:
+        counters['firestore_reads'] += reads
+        counters['firestore_round_trips'] += round_trips
+
+
+@contextmanager
+def stage_timer(timings: Dict[str, float], stage: str):
+    """Record the wall-clock duration (ms) of a pipeline stage into `timings`."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[stage] = round((time.perf_counter() - start) * 1000, 2)
+
+
+# Deployed separately from the API, so StackSampler is duplicated there;
+# test_stack_sampler_matches_sync_copy keeps the two identical.
+class StackSampler:
+    """
+    Samples one thread's stack on a timer and counts identical stacks.
+    
+    Use as a context manager around the code to profile; by default the
+    sampled thread is the one entering the context. `write` produces
+    collapsed stacks (one `frame;frame;frame count` line per stack), which
+    flamegraph.pl and speedscope render directly.
+    """
+    
+    def __init__(self, interval: float = 0.005, thread_id: Optional[int] = None):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+    
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+    
+    def __enter__(self):
+        if self.thread_id is None:
+            self.thread_id = threading.get_ident()
+        self._thread.start()
+        return self
+    
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+    
+    def write(self, path: str):
+        with open(path, 'w') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+def get_profile_mode(request) -> Optional[str]:
+    """Profiling mode requested via ?profile= or the SYNC_PROFILE env var."""
+    args = getattr(request, 'args', None) or {}
+    mode = args.get('profile') or os.environ.get('SYNC_PROFILE')
+    if mode in ('1', 'true', 'sample'):
+        return 'sample'
+    if mode == 'cprofile':
+        return 'cprofile'
+    return None
+
+
+def backfill_options(args) -> Dict[str, Any]:
+    """Parse and validate ?shards=, ?workers= and ?executor= for a backfill; raises ValueError."""
+    try:
+        options = {
+            'shard_count': int(args.get('shards', BACKFILL_SHARDS)),
+            'workers': int(args.get('workers', BACKFILL_WORKERS)),
+            'executor': args.get('executor', BACKFILL_EXECUTOR),
+        }
+    except ValueError:
+        raise ValueError("shards and workers must be integers")
+    if options['shard_count'] < 1 or options['workers'] < 1:
+        raise ValueError("shards and workers must be at least 1")
+    if options['executor'] not in ('process', 'fanout'):
+        raise ValueError(f"Unknown executor {options['executor']!r}; expected 'process' or 'fanout'")
+    return options
+
+
+def select_run(request):
+    """
+    Pick the run for this invocation from ?mode= (sync, backfill or
+    backfill_shard). ?rebuild_funders=1 re-seeds the funder aggregates.
+    
+    Invalid backfill parameters yield a run that returns a 400.
+    """
+    args = getattr(request, 'args', None) or {}
+    mode = args.get('mode')
+    if mode == 'backfill':
+        try:
+            options = backfill_options(args)
+        except ValueError as e:
+            message = str(e)
+            return lambda: ({'status': 'error', 'message': message}, 400)
+        return lambda: run_backfill(**options)
+    if mode == 'backfill_shard':
+        return lambda: run_backfill_shard_request(args)
+    if args.get('rebuild_funders') in ('1', 'true'):
+        return lambda: run_sync(rebuild_funders=True)
+    return run_sync
+
+
+def read_sync_metadata(db: firestore.Client):
+    """Snapshot of metadata/sync: the watermark and any backfill lease."""
+    return db.collection('metadata').document('sync').get()
+
+
+def get_last_sync_time(sync_doc) -> datetime:
+    """Get the last successful sync timestamp from a metadata/sync snapshot."""
     if sync_doc.exists:
         return sync_doc.to_dict().get('last_sync_time', datetime(2000, 1, 1, tzinfo=timezone.utc))
     return datetime(2000, 1, 1, tzinfo=timezone.utc)
 
 
-def update_sync_time(db: firestore.Client, sync_time: datetime):
-    """Update the last successful sync timestamp."""
-    db.collection('metadata').document('sync').set({
-        'last_sync_time': sync_time,
-        'updated_at': firestore.SERVER_TIMESTAMP
-    })
+def active_backfill_lease(sync_doc) -> Optional[Dict[str, Any]]:
+    """The backfill lease in a metadata/sync snapshot, unless absent or expired."""
+    lease = (sync_doc.to_dict() or {}).get('backfill_lease') if sync_doc.exists else None
+    if lease and lease.get('expires_at') and lease['expires_at'] > datetime.now(timezone.utc):
+        return lease
+    return None
+
+
+def _write_sync_metadata(db: firestore.Client, sync_doc, fields: Dict[str, Any]) -> bool:
+    """
+    Write `fields` to metadata/sync only if it hasn't changed since `sync_doc`
+    was read. Returns False if another run wrote it first.
+    """
+    sync_ref = db.collection('metadata').document('sync')
+    try:
+        if sync_doc.exists:
+            sync_ref.update(fields, option=db.write_option(last_update_time=sync_doc.update_time))
+        else:
+            sync_ref.create(fields)
+    except (FailedPrecondition, Conflict):
+        return False
+    return True
+
+
+def update_sync_time(db: firestore.Client, sync_time: datetime, sync_doc=None) -> bool:
+    """
+    Update the last successful sync timestamp.
+    
+    With `sync_doc`, the watermark only moves if metadata/sync is unchanged
+    since that read, so a sync that overlapped a backfill can't advance it
+    past the backfill's start time. Returns whether it was written.
+    """
+    fields = {'last_sync_time': sync_time, 'updated_at': firestore.SERVER_TIMESTAMP}
+    if sync_doc is not None:
+        return _write_sync_metadata(db, sync_doc, fields)
+    db.collection('metadata').document('sync').set(fields, merge=True)
+    return True
+
+
+def acquire_backfill_lease(db: firestore.Client, run_id: str) -> bool:
+    """Take the backfill lease in metadata/sync; False if another backfill holds it."""
+    sync_doc = read_sync_metadata(db)
+    if active_backfill_lease(sync_doc):
+        return False
+    expires_at = datetime.now(timezone.utc) + timedelta(seconds=BACKFILL_LEASE_SECONDS)
+    return _write_sync_metadata(db, sync_doc, {'backfill_lease': {'run_id': run_id, 'expires_at': expires_at}})
+
+
+def release_backfill_lease(db: firestore.Client, run_id: str):
+    """Drop the backfill lease if this run still holds it."""
+    lease = active_backfill_lease(read_sync_metadata(db))
+    if lease and lease.get('run_id') == run_id:
+        db.collection('metadata').document('sync').update({'backfill_lease': firestore.DELETE_FIELD})
 
 
-def fetch_modified_grants(db: firestore.Client, since: datetime) -> List[Dict[str, Any]]:
+def save_run_report(db: firestore.Client, report: Dict[str, Any]):
+    """Persist a sync run report under metadata/sync_runs/runs/{run_id}."""
+    db.collection('metadata').document('sync_runs').collection('runs').document(report['run_id']).set(report)
+
+
+def fetch_modified_grants(
+    db: firestore.Client,
+    since: datetime,
+    counters: Optional[Dict[str, int]] = None
+) -> List[Dict[str, Any]]:
     """Fetch grants modified since last sync."""
     grants_ref = db.collection('grants')
     query = grants_ref.where('updated_at', '>=', since).stream()
@@ -40,14 +277,22 @@ def fetch_modified_grants(db: firestore.Client, since: datetime) -> List[Dict[st
         grant_data['grant_id'] = doc.id
         grants.append(grant_data)
     
+    _count_reads(counters, len(grants))
     return grants
 
 
-def denormalize_grant(db: firestore.Client, grant: Dict[str, Any]) -> Dict[str, Any]:
+def denormalize_grant(
+    db: firestore.Client,
+    grant: Dict[str, Any],
+    counters: Optional[Dict[str, int]] = None
+) -> Dict[str, Any]:
     """
     Denormalize a grant by joining with related collections.
     
     This is the critical transformation: OLTP → OLAP
+    
+    If `counters` is given, Firestore document reads and round trips made
+    for this grant are added to it.
     """
     grant_id = grant['grant_id']
     
@@ -55,6 +300,7 @@ def denormalize_grant(db: firestore.Client, grant: Dict[str, Any]) -> Dict[str,
     funder = None
     if 'funder_id' in grant:
         funder_doc = db.collection('funders').document(grant['funder_id']).get()
+        _count_reads(counters, 1)
         if funder_doc.exists:
             funder = funder_doc.to_dict()
     
@@ -66,7 +312,9 @@ def denormalize_grant(db: firestore.Client, grant: Dict[str, Any]) -> Dict[str,
         # Fallback to subcollection for historical data
         deadlines_ref = db.collection('grants').document(grant_id).collection('deadlines')
         all_deadlines = []
-        for deadline_doc in deadlines_ref.stream():
+        deadline_docs = list(deadlines_ref.stream())
+        _count_reads(counters, len(deadline_docs))
+        for deadline_doc in deadline_docs:
             d_data = deadline_doc.to_dict()
             if d_data.get('close_date'):
                 all_deadlines.append(d_data)
@@ -79,7 +327,9 @@ def denormalize_grant(db: firestore.Client, grant: Dict[str, Any]) -> Dict[str,
     # Fetch eligibility (merge all into single record)
     eligibility = {}
     eligibility_ref = db.collection('grants').document(grant_id).collection('eligibility')
-    for elig_doc in eligibility_ref.stream():
+    elig_docs = list(eligibility_ref.stream())
+    _count_reads(counters, len(elig_docs))
+    for elig_doc in elig_docs:
         eligibility.update(elig_doc.to_dict())
     
     # Fetch geography (take first one)
@@ -88,12 +338,15 @@ def denormalize_grant(db: firestore.Client, grant: Dict[str, Any]) -> Dict[str,
     for geo_doc in geo_ref.stream():
         geography = geo_doc.to_dict()
         break
+    _count_reads(counters, 1 if geography is not None else 0)
     
     # Fetch categories (priority: root array > subcollection)
     categories = grant.get('categories', [])
     if not categories:
         cat_ref = db.collection('grants').document(grant_id).collection('categories')
-        for cat_doc in cat_ref.stream():
+        cat_docs = list(cat_ref.stream())
+        _count_reads(counters, len(cat_docs))
+        for cat_doc in cat_docs:
             cat_data = cat_doc.to_dict()
             if 'category_id' in cat_data:
                 categories.append(cat_data['category_id'])
@@ -133,10 +386,51 @@ def denormalize_grant(db: firestore.Client, grant: Dict[str, Any]) -> Dict[str,
         'created_at': grant.get('created_at'),
         'updated_at': grant.get('updated_at'),
     }
+    flat_record.update(search_fields(flat_record))
     
     return flat_record
 
 
+def summarize(values: List[int]) -> Dict[str, Any]:
+    """Min / mean / max summary of per-grant counters."""
+    if not values:
+        return {'min': 0, 'mean': 0, 'max': 0}
+    return {'min': min(values), 'mean': round(sum(values) / len(values), 2), 'max': max(values)}
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase, strip accents and split into alphanumeric search tokens."""
+    text = unicodedata.normalize('NFKD', text.lower())
+    text = ''.join(ch for ch in text if not unicodedata.combining(ch))
+    return [t for t in _TOKEN_RE.findall(text) if len(t) > 1 and t not in SEARCH_STOPWORDS]
+
+
+def _text_values(value) -> List[str]:
+    if isinstance(value, str):
+        return [value]
+    if isinstance(value, dict):
+        return [t for v in value.values() for t in _text_values(v)]
+    if isinstance(value, list):
+        return [t for v in value for t in _text_values(v)]
+    return []
+
+
+def search_fields(record: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Term frequencies for the search index over title, summary,
+    eligible_industries and at_a_glance text.
+    """
+    tokens = tokenize(record.get('title') or '') * SEARCH_TITLE_BOOST
+    for field in ('summary', 'eligible_industries', 'at_a_glance'):
+        for text in _text_values(record.get(field)):
+            tokens.extend(tokenize(text))
+    
+    return {
+        'search_terms': [{'term': term, 'tf': tf} for term, tf in sorted(Counter(tokens).items())],
+        'search_length': len(tokens),
+    }
+
+
 def to_json_serializable(obj):
     """Recursively convert datetime objects to strings for JSON serialization."""
     if isinstance(obj, datetime):
@@ -148,31 +442,310 @@ def to_json_serializable(obj):
     return obj
 
 
-def upsert_to_bigquery(bq_client: bigquery.Client, records: List[Dict[str, Any]]):
-    """Upsert records to BigQuery grants_flat table."""
+def load_job_stats(job) -> Dict[str, Any]:
+    """Extract size and duration statistics from a completed BigQuery load job."""
+    duration_ms = None
+    if job.started and job.ended:
+        duration_ms = round((job.ended - job.started).total_seconds() * 1000, 2)
+    return {
+        'job_id': job.job_id,
+        'output_rows': job.output_rows,
+        'output_bytes': job.output_bytes,
+        'input_file_bytes': job.input_file_bytes,
+        'duration_ms': duration_ms,
+    }
+
+
+def load_to_bigquery(
+    bq_client: bigquery.Client,
+    records: List[Dict[str, Any]],
+    table_id: str,
+    write_disposition: str = bigquery.WriteDisposition.WRITE_APPEND
+) -> Optional[Dict[str, Any]]:
+    """
+    Load records into `table_id` (a sync or backfill staging table).
+    
+    Returns load job statistics, or None if there was nothing to load.
+    """
     if not records:
         print("No records to sync")
-        return
+        return None
     
     # Convert datetime objects to JSON-serializable strings
     records = to_json_serializable(records)
     
-    project_id = os.environ.get('GCP_PROJECT')
-    table_id = f"{project_id}.grants_warehouse.grants_flat"
-    
     # BigQuery streaming inserts are expensive, so we use load job instead
     job_config = bigquery.LoadJobConfig(
-        write_disposition=bigquery.WriteDisposition.WRITE_TRUNCATE,  # For now, full refresh
+        write_disposition=write_disposition,
         source_format=bigquery.SourceFormat.NEWLINE_DELIMITED_JSON,
     )
     
-    # TODO: Implement incremental upsert using MERGE statement
-    # For MVP, full table refresh is acceptable
-    
     job = bq_client.load_table_from_json(records, table_id, job_config=job_config)
     job.result()  # Wait for job to complete
     
-    print(f"Synced {len(records)} records to BigQuery")
+    print(f"Loaded {len(records)} records into {table_id}")
+    return load_job_stats(job)
+
+
+def merge_into_grants_flat(bq_client: bigquery.Client, staging_table: str) -> Dict[str, Any]:
+    """Upsert the staging table's rows into grants_flat, matching on grant_id."""
+    project_id = os.environ.get('GCP_PROJECT')
+    columns = [field.name for field in bq_client.get_table(staging_table).schema]
+    updates = ', '.join(f"{c} = S.{c}" for c in columns if c != 'grant_id')
+    
+    # grants_flat requires a partition filter; rolling grants live in the NULL partition
+    query = f"""
+    MERGE `{project_id}.grants_warehouse.grants_flat` T
+    USING `{staging_table}` S
+    ON T.grant_id = S.grant_id
+        AND (T.deadline_close IS NULL OR T.deadline_close >= DATE '1970-01-01')
+    WHEN MATCHED THEN
+        UPDATE SET {updates}
+    WHEN NOT MATCHED THEN
+        INSERT ({', '.join(columns)}) VALUES ({', '.join(f"S.{c}" for c in columns)})
+    """
+    job = bq_client.query(query)
+    job.result()
+    return {'job_id': job.job_id, 'rows_affected': job.num_dml_affected_rows}
+
+
+def upsert_to_bigquery(bq_client: bigquery.Client, records: List[Dict[str, Any]], run_id: str) -> Dict[str, Any]:
+    """
+    Upsert records into grants_flat.
+    
+    The records are loaded into a per-run staging table and MERGEd on
+    grant_id, so grants that did not change keep their rows. The staging
+    table is dropped afterwards.
+    """
+    staging_table = create_staging_table(bq_client, run_id, purpose='sync')
+    try:
+        load_stats = load_to_bigquery(
+            bq_client, records, staging_table,
+            write_disposition=bigquery.WriteDisposition.WRITE_TRUNCATE
+        )
+        merge_stats = merge_into_grants_flat(bq_client, staging_table)
+    finally:
+        try:
+            bq_client.delete_table(staging_table, not_found_ok=True)
+        except Exception as e:
+            print(f"Failed to delete staging table {staging_table}: {e}")
+    
+    print(f"Upserted {len(records)} records into grants_flat")
+    return {'load_job': load_stats, 'merge_job': merge_stats}
+
+
+def _as_date(value) -> Optional[date]:
+    """Coerce a Firestore timestamp, date or ISO string to a date."""
+    if value is None or value == '':
+        return None
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    try:
+        return date.fromisoformat(str(value)[:10])
+    except ValueError:
+        return None
+
+
+def funder_contribution(record: Dict[str, Any]) -> Dict[str, Any]:
+    """The fields of a flat grant record that feed the funder aggregates."""
+    deadline_close = _as_date(record.get('deadline_close'))
+    created_at = _as_date(record.get('created_at'))
+    return {
+        'funder_name': record.get('funder_name'),
+        'status': record.get('status'),
+        'max_amount': record.get('max_amount'),
+        'deadline_close': deadline_close.isoformat() if deadline_close else None,
+        'created_at': created_at.isoformat() if created_at else None,
+    }
+
+
+def aggregate_funder(funder_name: str, contributions: List[Dict[str, Any]], today: date) -> Dict[str, Any]:
+    """
+    Aggregate one funder's grant contributions into a funders_activity row.
+    
+    A grant counts as open if its status is open and its deadline has not
+    passed (rolling grants without a deadline stay open).
+    """
+    open_grants = [
+        c for c in contributions
+        if c.get('status') == 'open' and (c.get('deadline_close') is None or c['deadline_close'] >= today.isoformat())
+    ]
+    amounts = [c['max_amount'] for c in open_grants if c.get('max_amount') is not None]
+    deadlines = [c['deadline_close'] for c in open_grants if c.get('deadline_close')]
+    posted = [c['created_at'] for c in contributions if c.get('created_at')]
+    return {
+        'funder_name': funder_name,
+        'open_grants': len(open_grants),
+        'total_funding': sum(amounts),
+        'avg_award': round(sum(amounts) / len(amounts), 2) if amounts else None,
+        'next_deadline': min(deadlines) if deadlines else None,
+        'last_posted': max(posted) if posted else None,
+    }
+
+
+def _funder_key(funder_name: str) -> str:
+    return hashlib.sha1(funder_name.encode()).hexdigest()
+
+
+def update_funder_contributions(
+    db: firestore.Client,
+    flat_records: List[Dict[str, Any]],
+    counters: Optional[Dict[str, int]] = None
+) -> Set[str]:
+    """
+    Store the changed grants' aggregate inputs in `funder_contributions/{grant_id}`.
+    
+    Returns the funders that gained or lost one of these grants.
+    """
+    contributions_ref = db.collection('funder_contributions')
+    new = {r['grant_id']: funder_contribution(r) for r in flat_records if r.get('funder_name')}
+    
+    # Funders that lose a grant: read the previous contributions in one round trip
+    affected = {c['funder_name'] for c in new.values()}
+    if new:
+        previous = list(db.get_all([contributions_ref.document(grant_id) for grant_id in new]))
+        _count_reads(counters, len(previous))
+        for doc in previous:
+            if doc.exists:
+                affected.add(doc.to_dict().get('funder_name'))
+    
+    grant_ids = list(new)
+    for start in range(0, len(grant_ids), FIRESTORE_BATCH_SIZE):
+        batch = db.batch()
+        for grant_id in grant_ids[start:start + FIRESTORE_BATCH_SIZE]:
+            batch.set(contributions_ref.document(grant_id), new[grant_id])
+        batch.commit()
+    
+    affected.discard(None)
+    return affected
+
+
+def rebuild_funder_contributions(
+    db: firestore.Client,
+    counters: Optional[Dict[str, int]] = None
+) -> Set[str]:
+    """
+    Rewrite `funder_contributions` from the entire grants collection.
+    
+    Seeds the aggregates on first deployment, when only the grants changed
+    since the last sync would otherwise be counted. Contributions of grants
+    that no longer exist are deleted. Returns every funder seen, so all of
+    them are re-aggregated.
+    """
+    flat_records = []
+    for grant in fetch_grants_in_range(db, None, None, counters):
+        try:
+            flat_records.append(denormalize_grant(db, grant, counters))
+        except Exception as e:
+            print(f"Error denormalizing grant {grant.get('grant_id')}: {e}")
+    
+    affected = delete_stale_contributions(db, {r['grant_id'] for r in flat_records}, counters)
+    affected |= update_funder_contributions(db, flat_records, counters)
+    print(f"Rebuilt funder contributions for {len(flat_records)} grants")
+    return affected
+
+
+def delete_stale_contributions(
+    db: firestore.Client,
+    current_ids: Set[str],
+    counters: Optional[Dict[str, int]] = None
+) -> Set[str]:
+    """
+    Delete contributions of grants not in `current_ids` (deleted grants).
+    
+    Returns the funders that lost a grant.
+    """
+    existing = list(db.collection('funder_contributions').stream())
+    _count_reads(counters, len(existing))
+    
+    affected = set()
+    stale = [doc for doc in existing if doc.id not in current_ids]
+    for start in range(0, len(stale), FIRESTORE_BATCH_SIZE):
+        batch = db.batch()
+        for doc in stale[start:start + FIRESTORE_BATCH_SIZE]:
+            affected.add(doc.to_dict().get('funder_name'))
+            batch.delete(doc.reference)
+        batch.commit()
+    
+    affected.discard(None)
+    return affected
+
+
+def refresh_funders_activity(
+    db: firestore.Client,
+    bq_client: bigquery.Client,
+    flat_records: List[Dict[str, Any]],
+    counters: Optional[Dict[str, int]] = None,
+    today: Optional[date] = None,
+    affected: Optional[Set[str]] = None,
+    rebuild: bool = False,
+    contributions_complete: bool = False
+) -> Dict[str, Any]:
+    """
+    Incrementally recompute funder aggregates from the changed grants.
+    
+    Each grant's aggregate inputs are kept in `funder_contributions/{grant_id}`.
+    Only funders that gained or lost a changed grant, or whose next deadline
+    has passed, are re-aggregated (one query over their contribution docs).
+    Callers that already wrote contributions (backfill shards) pass the
+    funders they touched as `affected`.
+    
+    If the snapshot doesn't exist yet (first deployment) or `rebuild` is
+    set, contributions are first rebuilt from every grant, so the
+    aggregates never start from a partial set of changed grants. A backfill
+    has just written every contribution itself and passes
+    `contributions_complete` to skip that serial rebuild.
+    The merged snapshot is stored in `metadata/funders_activity`, which the
+    API serves from memory, and loaded into the funders_activity table.
+    """
+    today = today or datetime.now(timezone.utc).date()
+    contributions_ref = db.collection('funder_contributions')
+    snapshot_ref = db.collection('metadata').document('funders_activity')
+    
+    snapshot_doc = snapshot_ref.get()
+    _count_reads(counters, 1)
+    affected = set(affected or ())
+    if contributions_complete and not snapshot_doc.exists:
+        funders = {}
+    elif rebuild or not snapshot_doc.exists:
+        funders = {}
+        affected |= rebuild_funder_contributions(db, counters)
+    else:
+        funders = (snapshot_doc.to_dict() or {}).get('funders', {})
+        affected |= update_funder_contributions(db, flat_records, counters)
+    
+    # Funders whose next deadline has passed need their open counts refreshed
+    affected.update(
+        row['funder_name'] for row in funders.values()
+        if row.get('next_deadline') and row['next_deadline'] < today.isoformat()
+    )
+    affected.discard(None)
+    
+    for funder_name in affected:
+        docs = list(contributions_ref.where('funder_name', '==', funder_name).stream())
+        _count_reads(counters, len(docs))
+        key = _funder_key(funder_name)
+        if docs:
+            funders[key] = aggregate_funder(funder_name, [d.to_dict() for d in docs], today)
+        else:
+            funders.pop(key, None)
+    
+    rows = sorted(funders.values(), key=lambda row: row['open_grants'], reverse=True)
+    snapshot_ref.set({'funders': funders, 'updated_at': firestore.SERVER_TIMESTAMP})
+    
+    if affected:
+        project_id = os.environ.get('GCP_PROJECT')
+        job_config = bigquery.LoadJobConfig(
+            write_disposition=bigquery.WriteDisposition.WRITE_TRUNCATE,
+            source_format=bigquery.SourceFormat.NEWLINE_DELIMITED_JSON,
+        )
+        job = bq_client.load_table_from_json(rows, f"{project_id}.grants_warehouse.funders_activity", job_config=job_config)
+        job.result()
+    
+    print(f"Refreshed {len(affected)} of {len(rows)} funders")
+    return {'funders_refreshed': len(affected), 'funders_total': len(rows)}
 
 
 @functions_framework.http
@@ -180,46 +753,438 @@ def sync_to_bigquery(request):
     """
     HTTP Cloud Function triggered by Cloud Scheduler.
     
-    Syncs modified grants from Firestore to BigQuery.
+    Syncs modified grants from Firestore to BigQuery, or runs a sharded
+    backfill (see `select_run`), optionally under a profiler (see
+    `get_profile_mode`).
     """
+    run = select_run(request)
+    mode = get_profile_mode(request)
+    if mode is None:
+        return run()
+    
+    os.makedirs(SYNC_PROFILE_DIR, exist_ok=True)
+    path = os.path.join(SYNC_PROFILE_DIR, f"sync-{int(time.time())}-{uuid.uuid4().hex[:8]}")
+    if mode == 'cprofile':
+        profiler = cProfile.Profile()
+        body, status = profiler.runcall(run)
+        path += '.prof'
+        profiler.dump_stats(path)
+    else:
+        with StackSampler(SYNC_PROFILE_INTERVAL) as sampler:
+            body, status = run()
+        path += '.folded'
+        sampler.write(path)
+    
+    print(f"Wrote {mode} profile to {path}")
+    body['profile_output'] = path
+    return body, status
+
+
+class SyncSkipped(Exception):
+    """Raised to end a sync run early without treating it as a failure."""
+
+
+def run_sync(rebuild_funders: bool = False):
+    """
+    Sync modified grants from Firestore to BigQuery.
+    
+    With `rebuild_funders`, funder contributions are rebuilt from the whole
+    grants collection (see `rebuild_funder_contributions`).
+    
+    Runs are skipped while a backfill holds the lease in metadata/sync.
+    
+    Every run produces a report with per-stage timings (ms), Firestore
+    read/round-trip counts and load job statistics. The report is logged,
+    persisted to metadata/sync_runs and returned in the response.
+    """
+    run_id = uuid.uuid4().hex
+    timings: Dict[str, float] = {}
+    counters = new_counters()
+    per_grant_reads: List[int] = []
+    per_grant_round_trips: List[int] = []
+    report: Dict[str, Any] = {'run_id': run_id, 'timings_ms': timings, 'counters': counters}
+    run_start = time.perf_counter()
+    db = None
+    
     try:
         # Initialize clients
-        db = firestore.Client()
-        bq_client = bigquery.Client()
+        with stage_timer(timings, 'init_clients'):
+            db = firestore.Client()
+            bq_client = bigquery.Client()
         
         # Get last sync time
-        last_sync = get_last_sync_time(db)
+        with stage_timer(timings, 'read_sync_metadata'):
+            sync_doc = read_sync_metadata(db)
+            _count_reads(counters, 1)
+        last_sync = get_last_sync_time(sync_doc)
         current_sync = datetime.now(timezone.utc)
+        report['last_sync_time'] = last_sync.isoformat()
+        report['sync_time'] = current_sync.isoformat()
+        
+        # A running backfill rewrites grants_flat and resets the watermark itself
+        lease = active_backfill_lease(sync_doc)
+        if lease:
+            raise SyncSkipped(f"Backfill {lease.get('run_id')} is running")
         
         print(f"Starting sync. Last sync: {last_sync}")
         
         # Fetch modified grants
-        modified_grants = fetch_modified_grants(db, last_sync)
+        with stage_timer(timings, 'fetch_modified'):
+            modified_grants = fetch_modified_grants(db, last_sync, counters)
         print(f"Found {len(modified_grants)} modified grants")
         
         # Denormalize each grant
         flat_records = []
-        for grant in modified_grants:
-            try:
-                flat_record = denormalize_grant(db, grant)
-                flat_records.append(flat_record)
-            except Exception as e:
-                print(f"Error denormalizing grant {grant.get('grant_id')}: {e}")
-                continue
+        errors = 0
+        with stage_timer(timings, 'denormalize'):
+            for grant in modified_grants:
+                grant_counters = new_counters()
+                try:
+                    flat_record = denormalize_grant(db, grant, grant_counters)
+                    flat_records.append(flat_record)
+                except Exception as e:
+                    errors += 1
+                    print(f"Error denormalizing grant {grant.get('grant_id')}: {e}")
+                    continue
+                finally:
+                    for key, value in grant_counters.items():
+                        counters[key] += value
+                    per_grant_reads.append(grant_counters['firestore_reads'])
+                    per_grant_round_trips.append(grant_counters['firestore_round_trips'])
         
         # Upsert to BigQuery
-        if flat_records:
-            upsert_to_bigquery(bq_client, flat_records)
+        upsert_stats = {'load_job': None, 'merge_job': None}
+        with stage_timer(timings, 'bigquery_load'):
+            if flat_records:
+                upsert_stats = upsert_to_bigquery(bq_client, flat_records, run_id)
+        
+        # Refresh funder aggregates from the changed grants
+        with stage_timer(timings, 'funders_activity'):
+            funders_stats = refresh_funders_activity(db, bq_client, flat_records, counters, rebuild=rebuild_funders)
         
-        # Update sync metadata
-        update_sync_time(db, current_sync)
+        # Update sync metadata, unless a backfill started meanwhile
+        with stage_timer(timings, 'write_sync_metadata'):
+            watermark_written = update_sync_time(db, current_sync, sync_doc)
+        if not watermark_written:
+            print("metadata/sync changed during the run (backfill started); watermark left as is")
         
-        return {
+        report.update({
+            'status': 'success',
+            'grants_modified': len(modified_grants),
+            'grants_synced': len(flat_records),
+            'denormalize_errors': errors,
+            'reads_per_grant': summarize(per_grant_reads),
+            'round_trips_per_grant': summarize(per_grant_round_trips),
+            'load_job': upsert_stats['load_job'],
+            'merge_job': upsert_stats['merge_job'],
+            'funders_activity': funders_stats,
+            'watermark_written': watermark_written,
+        })
+        response = {
             'status': 'success',
             'grants_synced': len(flat_records),
             'sync_time': current_sync.isoformat()
         }, 200
+    
+    except SyncSkipped as e:
+        print(f"Sync skipped: {e}")
+        report.update({'status': 'skipped', 'message': str(e)})
+        response = {'status': 'skipped', 'message': str(e)}, 200
         
     except Exception as e:
         print(f"Sync failed: {e}")
+        report.update({'status': 'error', 'message': str(e)})
+        response = {'status': 'error', 'message': str(e)}, 500
+    
+    report['duration_ms'] = round((time.perf_counter() - run_start) * 1000, 2)
+    log_event('sync_run', severity='ERROR' if report['status'] == 'error' else 'INFO', report=report)
+    if db is not None:
+        try:
+            save_run_report(db, report)
+        except Exception as e:
+            print(f"Failed to persist run report: {e}")
+    
+    body, status = response
+    body['report'] = report
+    return body, status
+
+
+def plan_backfill_shards(db: firestore.Client, shard_count: int) -> List[tuple]:
+    """
+    Split the grants collection into document-ID ranges of similar size.
+    
+    Uses Firestore partition queries; each shard is a (start_id, end_id)
+    pair where start_id is inclusive, end_id exclusive and None is open.
+    """
+    partitions = db.collection_group('grants').get_partitions(shard_count)
+    return [
+        (p.start_at.id if p.start_at else None, p.end_at.id if p.end_at else None)
+        for p in partitions
+    ]
+
+
+def fetch_grants_in_range(
+    db: firestore.Client,
+    start_id: Optional[str],
+    end_id: Optional[str],
+    counters: Optional[Dict[str, int]] = None
+) -> List[Dict[str, Any]]:
+    """Fetch every grant whose document ID falls in [start_id, end_id)."""
+    query = db.collection('grants').order_by('__name__')  # document ID order
+    if start_id:
+        query = query.start_at([start_id])
+    if end_id:
+        query = query.end_before([end_id])
+    
+    grants = []
+    for doc in query.stream():
+        grant_data = doc.to_dict()
+        grant_data['grant_id'] = doc.id
+        grants.append(grant_data)
+    
+    _count_reads(counters, len(grants))
+    return grants
+
+
+def run_backfill_shard(
+    staging_table: str,
+    shard_index: int,
+    start_id: Optional[str],
+    end_id: Optional[str]
+) -> Dict[str, Any]:
+    """
+    Denormalize one shard and append it to the backfill staging table.
+    
+    Runs in a worker process or a separate function invocation, so it
+    creates its own clients. Also writes the shard's funder contributions
+    and returns the funders it touched for the final re-aggregation.
+    """
+    timings: Dict[str, float] = {}
+    counters = new_counters()
+    db = firestore.Client()
+    bq_client = bigquery.Client()
+    
+    with stage_timer(timings, 'fetch'):
+        grants = fetch_grants_in_range(db, start_id, end_id, counters)
+    
+    flat_records = []
+    errors = 0
+    with stage_timer(timings, 'denormalize'):
+        for grant in grants:
+            try:
+                flat_records.append(denormalize_grant(db, grant, counters))
+            except Exception as e:
+                errors += 1
+                print(f"Error denormalizing grant {grant.get('grant_id')}: {e}")
+    
+    with stage_timer(timings, 'bigquery_load'):
+        load_stats = load_to_bigquery(bq_client, flat_records, staging_table)
+    
+    with stage_timer(timings, 'funder_contributions'):
+        funders = update_funder_contributions(db, flat_records, counters)
+    
+    return {
+        'shard': shard_index,
+        'start_id': start_id,
+        'end_id': end_id,
+        'grants_synced': len(flat_records),
+        'denormalize_errors': errors,
+        'timings_ms': timings,
+        'counters': counters,
+        'load_job': load_stats,
+        'funders': sorted(funders),
+        'grant_ids': [r['grant_id'] for r in flat_records],
+    }
+
+
+def is_backfill_staging_table(table_id: str) -> bool:
+    """True only for a staging table named by create_staging_table for a backfill."""
+    project_id = os.environ.get('GCP_PROJECT') or ''
+    pattern = rf"{re.escape(project_id)}\.grants_warehouse\.grants_flat_backfill_[0-9a-f]+"
+    return bool(project_id) and re.fullmatch(pattern, table_id or '') is not None
+
+
+def run_backfill_shard_request(args) -> tuple:
+    """
+    HTTP entry point for a fanned-out shard (?mode=backfill_shard).
+    
+    `staging_table` must be a backfill staging table, so a request can
+    never append rows to grants_flat or any other table.
+    """
+    if not is_backfill_staging_table(args.get('staging_table')):
+        return {'status': 'error', 'message': "staging_table must be a grants_flat_backfill_<id> table"}, 400
+    try:
+        stats = run_backfill_shard(
+            args['staging_table'], int(args['shard']), args.get('start_id') or None, args.get('end_id') or None
+        )
+        return {'status': 'success', 'shard': stats}, 200
+    except Exception as e:
+        print(f"Backfill shard failed: {e}")
         return {'status': 'error', 'message': str(e)}, 500
+
+
+def invoke_backfill_shard(staging_table: str, shard_index: int, start_id: Optional[str], end_id: Optional[str]) -> Dict[str, Any]:
+    """Run a shard as its own invocation of this function, authenticated with an ID token."""
+    import google.auth.transport.requests
+    import google.oauth2.id_token
+    
+    if not BACKFILL_SHARD_URL:
+        raise RuntimeError("BACKFILL_SHARD_URL must be set for executor=fanout")
+    
+    token = google.oauth2.id_token.fetch_id_token(google.auth.transport.requests.Request(), BACKFILL_SHARD_URL)
+    params = urllib.parse.urlencode({
+        'mode': 'backfill_shard',
+        'staging_table': staging_table,
+        'shard': shard_index,
+        'start_id': start_id or '',
+        'end_id': end_id or '',
+    })
+    request = urllib.request.Request(
+        f"{BACKFILL_SHARD_URL}?{params}", method='POST', headers={'Authorization': f"Bearer {token}"}
+    )
+    with urllib.request.urlopen(request, timeout=BACKFILL_SHARD_TIMEOUT) as response:
+        return json.loads(response.read())['shard']
+
+
+def create_staging_table(bq_client: bigquery.Client, run_id: str, purpose: str = 'backfill') -> str:
+    """Create an empty copy of grants_flat for a sync or backfill run; it expires after a day if abandoned."""
+    project_id = os.environ.get('GCP_PROJECT')
+    target = bq_client.get_table(f"{project_id}.grants_warehouse.grants_flat")
+    
+    staging_id = f"{project_id}.grants_warehouse.grants_flat_{purpose}_{run_id}"
+    staging = bigquery.Table(staging_id, schema=target.schema)
+    staging.time_partitioning = target.time_partitioning
+    staging.clustering_fields = target.clustering_fields
+    staging.expires = datetime.now(timezone.utc) + timedelta(days=1)
+    bq_client.create_table(staging)
+    return staging_id
+
+
+def swap_into_grants_flat(bq_client: bigquery.Client, staging_table: str) -> Dict[str, Any]:
+    """Atomically replace grants_flat with the staging table (copy job, WRITE_TRUNCATE)."""
+    project_id = os.environ.get('GCP_PROJECT')
+    job_config = bigquery.CopyJobConfig(write_disposition=bigquery.WriteDisposition.WRITE_TRUNCATE)
+    job = bq_client.copy_table(staging_table, f"{project_id}.grants_warehouse.grants_flat", job_config=job_config)
+    job.result()
+    return {'job_id': job.job_id}
+
+
+def run_backfill(shard_count: int, workers: int, executor: str) -> tuple:
+    """
+    Rebuild grants_flat from the whole grants collection in parallel shards.
+    
+    Shards are processed independently, each appending to one staging
+    table. Only if every shard succeeds is the staging table swapped into
+    grants_flat in a single copy job, so readers never see a partial
+    rebuild. Shards also write every grant's funder contribution; after
+    the swap, contributions of grants no shard returned (deleted grants)
+    are dropped and the affected funders re-aggregated. The sync watermark
+    is then set to the backfill start time, so the next hourly sync MERGEs
+    in anything modified during the rebuild.
+    
+    The backfill holds a lease in metadata/sync throughout; hourly syncs
+    skip while it is held, and a sync already in flight won't move the
+    watermark (see `update_sync_time`).
+    """
+    run_id = uuid.uuid4().hex
+    started_at = datetime.now(timezone.utc)
+    timings: Dict[str, float] = {}
+    counters = new_counters()
+    report: Dict[str, Any] = {
+        'run_id': run_id, 'mode': 'backfill', 'executor': executor, 'workers': workers,
+        'sync_time': started_at.isoformat(), 'timings_ms': timings, 'counters': counters,
+    }
+    run_start = time.perf_counter()
+    db = None
+    bq_client = None
+    staging_table = None
+    leased = False
+    
+    try:
+        db = firestore.Client()
+        bq_client = bigquery.Client()
+        
+        leased = acquire_backfill_lease(db, run_id)
+        if not leased:
+            raise RuntimeError("Another backfill holds the lease in metadata/sync")
+        
+        with stage_timer(timings, 'plan_shards'):
+            shards = plan_backfill_shards(db, shard_count)
+            staging_table = create_staging_table(bq_client, run_id)
+        report['shards_planned'] = len(shards)
+        print(f"Starting backfill {run_id}: {len(shards)} shards, {workers} {executor} workers")
+        
+        shard_args = [(staging_table, i, start_id, end_id) for i, (start_id, end_id) in enumerate(shards)]
+        with stage_timer(timings, 'shards'):
+            if executor == 'fanout':
+                with ThreadPoolExecutor(max_workers=workers) as pool:
+                    results = list(pool.map(lambda a: invoke_backfill_shard(*a), shard_args))
+            else:
+                # gRPC clients are not fork-safe; workers start fresh interpreters
+                with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+                    results = list(pool.map(run_backfill_shard, *zip(*shard_args)))
+        
+        affected = set()
+        grant_ids = set()
+        for result in results:
+            affected.update(result['funders'])
+            grant_ids.update(result['grant_ids'])
+            for key, value in result['counters'].items():
+                counters[key] += value
+        
+        with stage_timer(timings, 'swap'):
+            swap_stats = swap_into_grants_flat(bq_client, staging_table)
+        
+        # Shards wrote every current contribution; drop those of deleted grants
+        with stage_timer(timings, 'funders_activity'):
+            affected |= delete_stale_contributions(db, grant_ids, counters)
+            funders_stats = refresh_funders_activity(
+                db, bq_client, [], counters, affected=affected, contributions_complete=True
+            )
+        
+        with stage_timer(timings, 'write_sync_metadata'):
+            update_sync_time(db, started_at)
+        
+        grants_synced = sum(r['grants_synced'] for r in results)
+        report.update({
+            'status': 'success',
+            'grants_synced': grants_synced,
+            'denormalize_errors': sum(r['denormalize_errors'] for r in results),
+            'shards': [{k: v for k, v in r.items() if k not in ('funders', 'grant_ids')} for r in results],
+            'swap_job': swap_stats,
+            'funders_activity': funders_stats,
+        })
+        response = {
+            'status': 'success',
+            'grants_synced': grants_synced,
+            'sync_time': started_at.isoformat()
+        }, 200
+    
+    except Exception as e:
+        print(f"Backfill failed: {e}")
+        report.update({'status': 'error', 'message': str(e)})
+        response = {'status': 'error', 'message': str(e)}, 500
+    
+    finally:
+        if staging_table:
+            try:
+                bq_client.delete_table(staging_table, not_found_ok=True)
+            except Exception as e:
+                print(f"Failed to delete staging table {staging_table}: {e}")
+        if leased:
+            try:
+                release_backfill_lease(db, run_id)
+            except Exception as e:
+                print(f"Failed to release backfill lease: {e}")
+    
+    report['duration_ms'] = round((time.perf_counter() - run_start) * 1000, 2)
+    log_event('backfill_run', severity='INFO' if report['status'] == 'success' else 'ERROR', report=report)
+    if db is not None:
+        try:
+            save_run_report(db, report)
+        except Exception as e:
+            print(f"Failed to persist run report: {e}")
+    
+    body, status = response
+    body['report'] = report
+    return body, status
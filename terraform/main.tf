@@ -141,11 +141,21 @@ resource "google_bigquery_table" "funders_activity" {
       type = "INT64"
       mode = "REQUIRED"
     },
+    {
+      name = "total_funding"
+      type = "INT64"
+      mode = "NULLABLE"
+    },
     {
       name = "avg_award"
       type = "FLOAT64"
       mode = "NULLABLE"
     },
+    {
+      name = "next_deadline"
+      type = "DATE"
+      mode = "NULLABLE"
+    },
     {
       name = "last_posted"
       type = "DATE"
@@ -207,6 +217,13 @@ resource "google_project_iam_member" "api_bigquery_job_user" {
   member  = "serviceAccount:${google_service_account.api.email}"
 }
 
+# Grant Firestore read access to API (sync generation for ETags)
+resource "google_project_iam_member" "api_firestore_read" {
+  project = var.project_id
+  role    = "roles/datastore.viewer"
+  member  = "serviceAccount:${google_service_account.api.email}"
+}
+
 # Secret Manager: API Keys (placeholder - keys added manually)
 resource "google_secret_manager_secret" "api_keys" {
   secret_id = "grants-api-keys"
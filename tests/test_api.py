@@ -5,13 +5,20 @@ Test suite for API endpoints
 import pytest
 from fastapi.testclient import TestClient
 from unittest.mock import Mock, patch
+from datetime import date, datetime, timezone
+from decimal import Decimal
+from google.cloud.bigquery import Row
+import ast
+import importlib.util
+import subprocess
 import sys
 import os
 
 # Add api directory to path
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../api'))
 
-from main import app
+from main import app, choose_encoding, json_response, rows_to_dicts, GrantCatalog, OrgProfile, warm_up, startup_timings
+import main as api_main
 
 
 client = TestClient(app)
@@ -80,5 +87,377 @@ def test_get_grant_not_found():
         assert response.status_code == 404
 
 
+def test_profile_header_writes_folded_stacks(tmp_path):
+    """Test that X-Profile writes a profile when profiling is enabled."""
+    headers = {"X-Profile-Token": "s3cret"}
+    with patch('main.PROFILE_ENABLED', True), patch('main.PROFILE_TOKEN', 's3cret'), \
+            patch('main.PROFILE_DIR', str(tmp_path)):
+        response = client.get("/", headers={**headers, "X-Profile": "sample"})
+        assert response.status_code == 200
+        assert response.headers['X-Profile-Output'].endswith('.folded')
+        assert '/' not in response.headers['X-Profile-Output']
+        
+        response = client.get("/", headers={**headers, "X-Profile": "cprofile"})
+        assert response.headers['X-Profile-Output'].endswith('.prof')
+    
+    assert len(list(tmp_path.iterdir())) == 2
+
+
+def test_profile_header_ignored_when_disabled():
+    """Test that X-Profile is a no-op unless PROFILE_ENABLED is set."""
+    response = client.get("/", headers={"X-Profile": "sample"})
+    assert response.status_code == 200
+    assert 'X-Profile-Output' not in response.headers
+
+
+@pytest.mark.parametrize('token', [None, 'wrong'])
+def test_profile_header_requires_token(tmp_path, token):
+    """Test that X-Profile is ignored without the matching X-Profile-Token."""
+    headers = {"X-Profile": "sample"}
+    if token:
+        headers["X-Profile-Token"] = token
+    with patch('main.PROFILE_ENABLED', True), patch('main.PROFILE_TOKEN', 's3cret'), \
+            patch('main.PROFILE_DIR', str(tmp_path)):
+        response = client.get("/", headers=headers)
+    
+    assert 'X-Profile-Output' not in response.headers
+    assert not list(tmp_path.iterdir())
+
+
+def test_profiles_are_capped(tmp_path):
+    """Test that only the newest PROFILE_MAX_FILES profiles are kept."""
+    headers = {"X-Profile": "sample", "X-Profile-Token": "s3cret"}
+    with patch('main.PROFILE_ENABLED', True), patch('main.PROFILE_TOKEN', 's3cret'), \
+            patch('main.PROFILE_DIR', str(tmp_path)), patch('main.PROFILE_MAX_FILES', 2):
+        for _ in range(4):
+            client.get("/", headers=headers)
+    
+    assert len(list(tmp_path.iterdir())) == 2
+
+
+def make_row(**values):
+    """Build a BigQuery Row from keyword values."""
+    return Row(tuple(values.values()), {k: i for i, k in enumerate(values)})
+
+
+def test_rows_to_dicts_serializes_bigquery_types():
+    """Test fast-path serialization of dates, timestamps, structs and numerics."""
+    rows = [make_row(
+        grant_id='g1',
+        deadline_close=date(2025, 12, 31),
+        updated_at=datetime(2025, 1, 1, tzinfo=timezone.utc),
+        at_a_glance={'funding': 'Up to $100k'},
+        score=Decimal('1.5'),
+    )]
+    
+    response = json_response({'grants': rows_to_dicts(rows)})
+    
+    assert response.body == (
+        b'{"grants":[{"grant_id":"g1","deadline_close":"2025-12-31",'
+        b'"updated_at":"2025-01-01T00:00:00+00:00","at_a_glance":{"funding":"Up to $100k"},"score":1.5}]}'
+    )
+
+
+def test_choose_encoding():
+    """Test Accept-Encoding negotiation."""
+    assert choose_encoding('gzip, deflate, br') == 'br'
+    assert choose_encoding('gzip, br;q=0') == 'gzip'
+    assert choose_encoding('identity') is None
+    assert choose_encoding('') is None
+
+
+def test_search_grants_compresses_large_responses():
+    """Test that large responses are compressed when the client accepts it."""
+    rows = [
+        make_row(grant_id=f'g{i}', title='Community Grant ' * 10, total_rows=50)
+        for i in range(50)
+    ]
+    with patch('main.get_bigquery_client') as mock_bq:
+        mock_bq.return_value.query.return_value.result.return_value = rows
+        
+        response = client.get(
+            "/api/v1/grants",
+            headers={"X-API-Key": "test-key", "Accept-Encoding": "gzip"}
+        )
+    
+    assert response.status_code == 200
+    assert response.headers['content-encoding'] == 'gzip'
+    assert int(response.headers['content-length']) < len(response.content)
+    assert response.json()['total_count'] == 50
+    assert 'total_rows' not in response.json()['grants'][0]
+
+
+def test_conditional_get_returns_304_without_querying():
+    """Test ETag round trip: a matching If-None-Match skips BigQuery."""
+    with patch('main.get_sync_generation', return_value='2025-01-01T00:00:00+00:00'), \
+            patch('main.get_bigquery_client') as mock_bq:
+        mock_bq.return_value.query.return_value.result.return_value = []
+        
+        response = client.get("/api/v1/grants?province=ON", headers={"X-API-Key": "test-key"})
+        etag = response.headers['ETag']
+        assert response.headers['Cache-Control'].startswith('private')
+        assert mock_bq.return_value.query.call_count == 1
+        
+        response = client.get(
+            "/api/v1/grants?province=ON",
+            headers={"X-API-Key": "test-key", "If-None-Match": etag}
+        )
+        assert response.status_code == 304
+        assert response.headers['ETag'] == etag
+        assert mock_bq.return_value.query.call_count == 1
+
+
+def test_conditional_get_keeps_cors_vary_for_credentialed_requests():
+    """Test that a reflected CORS origin keeps Vary: Origin and is never publicly cacheable."""
+    with patch('main.get_sync_generation', return_value='2025-01-01T00:00:00+00:00'), \
+            patch('main.get_bigquery_client') as mock_bq:
+        mock_bq.return_value.query.return_value.result.return_value = []
+        
+        response = client.get(
+            "/api/v1/grants?province=ON",
+            headers={"Origin": "https://a.example", "Cookie": "session=1"}
+        )
+    
+    assert response.headers['Access-Control-Allow-Origin'] == 'https://a.example'
+    vary = [v.strip() for v in response.headers['Vary'].split(',')]
+    assert {'Origin', 'X-API-Key', 'Accept-Encoding'} <= set(vary)
+    assert len(vary) == len({v.lower() for v in vary})
+    assert response.headers['Cache-Control'].startswith('private')
+
+
+def test_etag_changes_with_sync_generation_and_query():
+    """Test that ETags are keyed on the sync generation and the query."""
+    def etag_for(generation, url):
+        with patch('main.get_sync_generation', return_value=generation), \
+                patch('main.get_bigquery_client') as mock_bq:
+            mock_bq.return_value.query.return_value.result.return_value = []
+            return client.get(url, headers={"X-API-Key": "test-key"}).headers['ETag']
+    
+    base = etag_for('gen-1', "/api/v1/grants?province=ON&status=open")
+    assert etag_for('gen-1', "/api/v1/grants?status=open&province=ON") == base
+    assert etag_for('gen-2', "/api/v1/grants?province=ON&status=open") != base
+    assert etag_for('gen-1', "/api/v1/grants?province=QC&status=open") != base
+
+
+def test_list_funders_serves_snapshot_per_generation():
+    """Test that funders are served from the sync snapshot without BigQuery."""
+    funders = [
+        {'funder_name': 'Small Funder', 'open_grants': 1},
+        {'funder_name': 'Big Funder', 'open_grants': 12},
+    ]
+    with patch('main.get_sync_generation', return_value='gen-funders'), \
+            patch('main.load_funders_snapshot', return_value=sorted(
+                funders, key=lambda f: f['open_grants'], reverse=True)) as mock_load, \
+            patch('main.get_bigquery_client') as mock_bq:
+        for _ in range(3):
+            response = client.get("/api/v1/funders", headers={"X-API-Key": "test-key"})
+            assert response.status_code == 200
+            assert response.json()['funders'][0]['funder_name'] == 'Big Funder'
+    
+    assert mock_load.call_count == 1
+    assert not mock_bq.return_value.query.called
+
+
+def catalog_rows():
+    """Grant rows as loaded from grants_flat, with sync-computed search terms."""
+    def terms(**tf):
+        return [{'term': term, 'tf': count} for term, count in tf.items()]
+    return [
+        {'grant_id': 'youth', 'title': 'Youth Opportunities Fund', 'province': 'ON', 'status': 'open',
+         'categories': ['youth-development'], 'min_amount': 10000, 'max_amount': 250000,
+         'deadline_close': date(2099, 1, 1), 'search_terms': terms(youth=4, opportunities=3, fund=3), 'search_length': 10},
+        {'grant_id': 'arts', 'title': 'Arts Capital Grant', 'province': 'ON', 'status': 'open',
+         'categories': ['arts'], 'min_amount': 5000, 'max_amount': 50000,
+         'deadline_close': None, 'search_terms': terms(arts=3, capital=3, grant=3, youth=1), 'search_length': 10},
+        {'grant_id': 'closed', 'title': 'Youth Sport Grant', 'province': 'ON', 'status': 'closed',
+         'categories': ['sport'], 'min_amount': 1000, 'max_amount': 5000,
+         'deadline_close': None, 'search_terms': terms(youth=3, sport=3, grant=3), 'search_length': 9},
+    ]
+
+
+def test_grant_catalog_ranks_by_bm25_with_prefix_matching():
+    """Test BM25 ranking and prefix expansion of query terms."""
+    catalog = GrantCatalog(catalog_rows())
+    
+    scores = catalog.search("youth")
+    ranked = [catalog.grants[d]['grant_id'] for d, _ in sorted(scores.items(), key=lambda s: -s[1])]
+    assert ranked[-1] == 'arts'  # youth only appears in the body
+    
+    prefix = catalog.search("opportun")
+    assert [catalog.grants[d]['grant_id'] for d in prefix] == ['youth']
+    assert prefix[0] < catalog.search("opportunities")[0]
+    
+    assert 'search_terms' not in catalog.grants[0]
+
+
+def load_sync_module():
+    """Import the sync function's main.py under another name (both deployables are `main`)."""
+    path = os.path.join(os.path.dirname(__file__), '../functions/sync-to-bigquery/main.py')
+    spec = importlib.util.spec_from_file_location('sync_main', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def class_source(path: str, name: str) -> str:
+    """Source of the top-level class `name` in the file at `path`."""
+    with open(path) as f:
+        source = f.read()
+    node = next(n for n in ast.parse(source).body if isinstance(n, ast.ClassDef) and n.name == name)
+    return ast.get_source_segment(source, node)
+
+
+def test_stack_sampler_matches_sync_copy():
+    """Test the API and sync StackSampler copies stay identical."""
+    sync_path = os.path.join(os.path.dirname(__file__), '../functions/sync-to-bigquery/main.py')
+    assert class_source(api_main.__file__, 'StackSampler') == class_source(sync_path, 'StackSampler')
+
+
+def test_load_grant_catalog_reports_rows_without_search_terms(capsys):
+    """Test that grants without sync-computed terms are counted and logged."""
+    rows = catalog_rows()
+    rows[0]['search_terms'] = None
+    with patch('main.get_bigquery_client') as mock_bq, patch('main.rows_to_dicts', return_value=rows):
+        catalog = api_main.load_grant_catalog()
+    
+    assert catalog.unindexed == 1
+    assert 'have no search terms' in capsys.readouterr().out
+
+
+def test_query_tokenizer_matches_sync_index_tokenizer():
+    """Test the API and sync tokenizers agree, or query terms would never match the index."""
+    sync_main = load_sync_module()
+    samples = [
+        "Youth Opportunities Fund: Community-led projects for 2025",
+        "Fondation Trillium de l'Ontario : éducation et santé",
+        "Subventions pour les organismes à but non lucratif (OBNL) du Québec",
+        "Capital grants — up to $150,000 for co-ops & registered charities",
+        "ÉCOLE, Naïve café, Résumé; a an the de la",
+    ]
+    
+    assert api_main.SEARCH_STOPWORDS == sync_main.SEARCH_STOPWORDS
+    for text in samples:
+        assert api_main.tokenize(text) == sync_main.tokenize(text)
+
+
+def test_search_grants_keyword_query_applies_filters_in_process():
+    """Test q= search combines relevance ranking with structured filters."""
+    with patch('main.get_sync_generation', return_value='gen-search'), \
+            patch('main.load_grant_catalog', return_value=GrantCatalog(catalog_rows())), \
+            patch('main.get_bigquery_client') as mock_bq:
+        response = client.get(
+            "/api/v1/grants?q=youth&min_amount=100000",
+            headers={"X-API-Key": "test-key"}
+        )
+    
+    assert response.status_code == 200
+    body = response.json()
+    assert [g['grant_id'] for g in body['grants']] == ['youth']
+    assert body['total_count'] == 1
+    assert body['grants'][0]['relevance'] > 0
+    assert not mock_bq.return_value.query.called
+
+
+def eligibility_rows():
+    """Open grants with a range of eligibility rules."""
+    base = {'status': 'open', 'deadline_close': date(2099, 1, 1), 'province': 'ON', 'city': None,
+            'eligible_org_types': [], 'years_active_min': None, 'revenue_max': None, 'registered_required': None}
+    return [
+        {**base, 'grant_id': 'any'},
+        {**base, 'grant_id': 'charities', 'eligible_org_types': ['Charity'], 'registered_required': True},
+        {**base, 'grant_id': 'established', 'years_active_min': 5, 'revenue_max': 500000},
+        {**base, 'grant_id': 'ottawa', 'city': 'Ottawa'},
+        {**base, 'grant_id': 'quebec', 'province': 'QC'},
+        {**base, 'grant_id': 'expired', 'deadline_close': date(2000, 1, 1)},
+    ]
+
+
+def test_eligibility_match_ranks_and_explains():
+    """Test vectorized eligibility matching and per-rule reasons."""
+    catalog = GrantCatalog(eligibility_rows())
+    profile = OrgProfile(org_type='charity', years_active=2, annual_revenue=100000,
+                         registered=True, province='ON', city='Toronto')
+    
+    matches = catalog.eligibility.match(profile, date(2025, 1, 1))
+    
+    ids = [m['grant']['grant_id'] for m in matches]
+    assert ids[0] == 'charities'  # satisfies the most constraints
+    assert set(ids) == {'any', 'charities'}
+    assert matches[0]['reasons']['org_type']['status'] == 'pass'
+    assert matches[0]['reasons']['registered']['requirement'] is True
+    
+    everything = catalog.eligibility.match(profile.model_copy(update={'include_ineligible': True}), date(2025, 1, 1))
+    by_id = {m['grant']['grant_id']: m for m in everything}
+    assert 'expired' not in by_id
+    assert by_id['established']['eligible'] is False
+    assert by_id['established']['reasons']['years_active']['status'] == 'fail'
+    assert by_id['established']['reasons']['revenue']['status'] == 'pass'
+    assert by_id['ottawa']['reasons']['city']['status'] == 'fail'
+    assert by_id['quebec']['reasons']['province']['status'] == 'fail'
+
+
+def test_match_endpoint_reports_unknown_rules():
+    """Test POST /api/v1/match with a partial profile."""
+    with patch('main.get_sync_generation', return_value='gen-match'), \
+            patch('main.load_grant_catalog', return_value=GrantCatalog(eligibility_rows())):
+        response = client.post(
+            "/api/v1/match",
+            json={'province': 'ON'},
+            headers={"X-API-Key": "test-key"}
+        )
+    
+    assert response.status_code == 200
+    by_id = {m['grant']['grant_id']: m for m in response.json()['matches']}
+    assert set(by_id) == {'any', 'charities', 'established', 'ottawa'}
+    assert by_id['charities']['reasons']['org_type']['status'] == 'unknown'
+    assert by_id['any']['score'] > by_id['charities']['score']
+
+
+# Generous ceiling for importing the app in a fresh interpreter; the heavy
+# client libraries are deferred, so this is dominated by FastAPI itself.
+STARTUP_IMPORT_BUDGET_SECONDS = float(os.environ.get('STARTUP_IMPORT_BUDGET_SECONDS', '2.0'))
+
+
+def test_startup_import_defers_heavy_modules():
+    """Benchmark app import time and check heavy modules stay off the cold-start path."""
+    script = (
+        "import sys, time; start = time.perf_counter(); import main; "
+        "elapsed = time.perf_counter() - start; "
+        "heavy = [m for m in ('google.cloud.bigquery', 'google.cloud.firestore', 'numpy') if m in sys.modules]; "
+        "print(elapsed, ','.join(heavy))"
+    )
+    result = subprocess.run(
+        [sys.executable, '-c', script],
+        cwd=os.path.join(os.path.dirname(__file__), '../api'),
+        capture_output=True, text=True, check=True
+    )
+    elapsed, _, heavy = result.stdout.strip().partition(' ')
+    
+    assert heavy == ''
+    assert float(elapsed) < STARTUP_IMPORT_BUDGET_SECONDS
+
+
+def test_warm_up_records_timings_and_survives_failures():
+    """Test that warm-up steps are timed and failures don't abort startup."""
+    with patch('main.get_bigquery_client') as mock_bq, \
+            patch('main.get_sync_generation', return_value='gen-warm'), \
+            patch('main.get_grant_catalog', side_effect=RuntimeError('BigQuery unavailable')):
+        warm_up(['clients', 'catalog'])
+    
+    assert mock_bq.return_value.get_dataset.called
+    assert {'clients', 'catalog'} <= set(startup_timings)
+
+
+def test_warm_up_funders_primes_the_list_funders_cache():
+    """Test that warm-up and list_funders share one cached snapshot body."""
+    with patch('main.get_sync_generation', return_value='gen-warm-funders'), \
+            patch('main.load_funders_snapshot', return_value=[{'funder_name': 'Big Funder', 'open_grants': 3}]) as mock_load:
+        warm_up(['funders'])
+        response = client.get("/api/v1/funders", headers={"X-API-Key": "test-key"})
+    
+    assert response.json()['funders'][0]['funder_name'] == 'Big Funder'
+    assert mock_load.call_count == 1
+
+
 if __name__ == '__main__':
     pytest.main([__file__, '-v'])
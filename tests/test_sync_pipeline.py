@@ -4,14 +4,20 @@ Test suite for Firestore to BigQuery sync function
 
 import pytest
 from unittest.mock import Mock, patch
-from datetime import datetime, timezone
+from datetime import date, datetime, timezone
+from google.cloud.bigquery import SchemaField
 import sys
 import os
 
 # Add functions directory to path
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../functions/sync-to-bigquery'))
 
-from main import denormalize_grant, fetch_modified_grants
+from main import (
+    denormalize_grant, fetch_modified_grants, new_counters, sync_to_bigquery, get_profile_mode,
+    aggregate_funder, refresh_funders_activity, search_fields, tokenize,
+    plan_backfill_shards, run_backfill, select_run, rebuild_funder_contributions,
+    run_backfill_shard_request,
+)
 
 
 def test_denormalize_grant_basic():
@@ -102,5 +108,452 @@ def test_denormalize_grant_with_deadline():
     assert result['deadline_close'] == '2025-12-31'
 
 
+def test_denormalize_grant_counts_firestore_reads():
+    """Test that denormalization records Firestore reads and round trips."""
+    mock_db = Mock()
+    mock_funder_doc = Mock()
+    mock_funder_doc.exists = True
+    mock_funder_doc.to_dict.return_value = {'name': 'Test Funder', 'type': 'foundation'}
+    mock_db.collection.return_value.document.return_value.get.return_value = mock_funder_doc
+    mock_db.collection.return_value.document.return_value.collection.return_value.stream.return_value = []
+    
+    counters = new_counters()
+    denormalize_grant(mock_db, {'grant_id': 'test-grant-3', 'funder_id': 'test-funder'}, counters)
+    
+    # funder get + deadlines, eligibility, geography and categories streams
+    assert counters['firestore_round_trips'] == 5
+    assert counters['firestore_reads'] == 1
+
+
+def test_sync_returns_run_report():
+    """Test that a sync run reports stage timings, counters and load job stats."""
+    grant_doc = Mock()
+    grant_doc.id = 'test-grant-4'
+    grant_doc.to_dict.return_value = {
+        'title': 'Test Grant',
+        'deadline_open': '2025-01-01',
+        'deadline_close': '2025-12-31',
+        'categories': ['youth'],
+    }
+    
+    with patch('main.firestore.Client') as mock_fs, patch('main.bigquery.Client') as mock_bq, \
+            patch('main.create_staging_table', return_value='p.grants_warehouse.grants_flat_sync_x'):
+        db = mock_fs.return_value
+        db.collection.return_value.document.return_value.get.return_value.exists = False
+        db.collection.return_value.where.return_value.stream.return_value = [grant_doc]
+        db.collection.return_value.document.return_value.collection.return_value.stream.return_value = []
+        db.get_all.return_value = []
+        # No funders snapshot yet, so contributions are seeded from every grant
+        db.collection.return_value.order_by.return_value.stream.return_value = [grant_doc]
+        db.collection.return_value.stream.return_value = []
+        
+        load_job = mock_bq.return_value.load_table_from_json.return_value
+        load_job.job_id = 'job-1'
+        load_job.output_rows = 1
+        load_job.output_bytes = 512
+        load_job.input_file_bytes = 600
+        load_job.started = datetime(2025, 1, 1, 0, 0, 0, tzinfo=timezone.utc)
+        load_job.ended = datetime(2025, 1, 1, 0, 0, 2, tzinfo=timezone.utc)
+        mock_bq.return_value.get_table.return_value.schema = [
+            SchemaField('grant_id', 'STRING'), SchemaField('title', 'STRING'),
+        ]
+        merge_job = mock_bq.return_value.query.return_value
+        merge_job.job_id = 'job-2'
+        merge_job.num_dml_affected_rows = 1
+        
+        body, status = sync_to_bigquery(Mock(args={}))
+    
+    assert status == 200
+    report = body['report']
+    assert report['status'] == 'success'
+    assert report['grants_synced'] == 1
+    assert set(report['timings_ms']) >= {'fetch_modified', 'denormalize', 'bigquery_load'}
+    # sync metadata, grants query, 2 subcollections, then funders snapshot,
+    # seeding (all grants, 2 subcollections, existing contributions,
+    # previous contributions) and one funder re-aggregation
+    assert report['counters']['firestore_round_trips'] == 11
+    assert report['funders_activity']['funders_refreshed'] == 1
+    assert report['round_trips_per_grant']['max'] == 2
+    assert report['reads_per_grant'] == {'min': 0, 'mean': 0, 'max': 0}  # both subcollections empty
+    assert report['load_job']['output_bytes'] == 512
+    assert report['load_job']['duration_ms'] == 2000
+    
+    # Modified grants are staged and MERGEd on grant_id, not truncated into grants_flat
+    bq = mock_bq.return_value
+    assert bq.load_table_from_json.call_args_list[0].args[1] == 'p.grants_warehouse.grants_flat_sync_x'
+    merge_sql = bq.query.call_args.args[0]
+    assert 'USING `p.grants_warehouse.grants_flat_sync_x`' in merge_sql
+    assert 'ON T.grant_id = S.grant_id' in merge_sql
+    assert 'UPDATE SET title = S.title' in merge_sql
+    assert report['merge_job'] == {'job_id': 'job-2', 'rows_affected': 1}
+    bq.delete_table.assert_called_once_with('p.grants_warehouse.grants_flat_sync_x', not_found_ok=True)
+    
+    # Report persisted to metadata/sync_runs
+    runs = db.collection.return_value.document.return_value.collection.return_value.document
+    runs.assert_called_with(report['run_id'])
+    runs.return_value.set.assert_called_once_with(report)
+
+
+def test_get_profile_mode():
+    """Test profiling mode selection from the request query string."""
+    assert get_profile_mode(Mock(args={})) is None
+    assert get_profile_mode(Mock(args={'profile': '1'})) == 'sample'
+    assert get_profile_mode(Mock(args={'profile': 'cprofile'})) == 'cprofile'
+
+
+def test_sync_writes_profile(tmp_path):
+    """Test that a profiled sync run writes its profile and reports the path."""
+    with patch('main.SYNC_PROFILE_DIR', str(tmp_path)), \
+            patch('main.run_sync', return_value=({'status': 'success'}, 200)):
+        body, status = sync_to_bigquery(Mock(args={'profile': 'sample'}))
+    
+    assert status == 200
+    assert body['profile_output'].endswith('.folded')
+    assert os.path.exists(body['profile_output'])
+
+
+def test_aggregate_funder():
+    """Test funder aggregates only count open grants with future deadlines."""
+    contributions = [
+        {'status': 'open', 'max_amount': 100000, 'deadline_close': '2025-06-30', 'created_at': '2024-01-01'},
+        {'status': 'open', 'max_amount': 50000, 'deadline_close': None, 'created_at': '2024-03-01'},
+        {'status': 'open', 'max_amount': 75000, 'deadline_close': '2025-01-01', 'created_at': '2023-01-01'},
+        {'status': 'closed', 'max_amount': 20000, 'deadline_close': '2025-12-31', 'created_at': '2023-06-01'},
+    ]
+    
+    row = aggregate_funder('Test Funder', contributions, today=date(2025, 2, 1))
+    
+    assert row == {
+        'funder_name': 'Test Funder',
+        'open_grants': 2,
+        'total_funding': 150000,
+        'avg_award': 75000.0,
+        'next_deadline': '2025-06-30',
+        'last_posted': '2024-03-01',
+    }
+
+
+def test_refresh_funders_activity_only_reaggregates_affected_funders():
+    """Test that only funders touched by changed grants are recomputed."""
+    mock_db = Mock()
+    snapshot_doc = Mock()
+    snapshot_doc.exists = True
+    snapshot_doc.to_dict.return_value = {'funders': {
+        'other': {'funder_name': 'Other Funder', 'open_grants': 3, 'next_deadline': '2025-12-31'},
+    }}
+    mock_db.collection.return_value.document.return_value.get.return_value = snapshot_doc
+    
+    # The changed grant previously belonged to Old Funder
+    previous_doc = Mock()
+    previous_doc.exists = True
+    previous_doc.to_dict.return_value = {'funder_name': 'Old Funder'}
+    mock_db.get_all.return_value = [previous_doc]
+    
+    new_contribution = Mock()
+    new_contribution.to_dict.return_value = {'status': 'open', 'max_amount': 10000, 'deadline_close': '2025-03-01'}
+    
+    def contributions_for(field, op, funder_name):
+        query = Mock()
+        query.stream.return_value = [new_contribution] if funder_name == 'New Funder' else []
+        return query
+    mock_db.collection.return_value.where.side_effect = contributions_for
+    
+    record = {'grant_id': 'g1', 'funder_name': 'New Funder', 'status': 'open',
+              'max_amount': 10000, 'deadline_close': '2025-03-01'}
+    stats = refresh_funders_activity(mock_db, Mock(), [record], today=date(2025, 2, 1))
+    
+    assert stats == {'funders_refreshed': 2, 'funders_total': 2}
+    queried = {c.args[2] for c in mock_db.collection.return_value.where.call_args_list}
+    assert queried == {'New Funder', 'Old Funder'}
+    
+    saved = mock_db.collection.return_value.document.return_value.set.call_args.args[0]['funders']
+    assert {row['funder_name'] for row in saved.values()} == {'Other Funder', 'New Funder'}
+
+
+def test_search_fields_boost_title_and_index_nested_text():
+    """Test search term extraction across title, summary and at_a_glance."""
+    fields = search_fields({
+        'title': 'Youth Opportunities Fund',
+        'summary': 'Supports youth-led projects in the community.',
+        'eligible_industries': ['Arts'],
+        'at_a_glance': {'audience': 'Jeunes francophones', 'location': None},
+    })
+    terms = {t['term']: t['tf'] for t in fields['search_terms']}
+    
+    assert terms['youth'] == 4  # 3 (boosted title) + 1 (summary)
+    assert terms['arts'] == 1
+    assert terms['francophones'] == 1
+    assert 'in' not in terms
+    assert fields['search_length'] == sum(terms.values())
+
+
+def test_tokenize_strips_accents():
+    """Test that French text tokenizes to unaccented terms."""
+    assert tokenize("Fondation Trillium de l'Ontario : éducation") == ['fondation', 'trillium', 'ontario', 'education']
+
+
+def test_refresh_funders_activity_seeds_when_snapshot_missing():
+    """Test that the first run rebuilds contributions from every grant."""
+    mock_db = Mock()
+    snapshot_doc = Mock()
+    snapshot_doc.exists = False
+    mock_db.collection.return_value.document.return_value.get.return_value = snapshot_doc
+    mock_db.collection.return_value.where.return_value.stream.return_value = []
+    
+    with patch('main.rebuild_funder_contributions', return_value={'Funder A', 'Funder B'}) as mock_rebuild, \
+            patch('main.update_funder_contributions') as mock_update:
+        stats = refresh_funders_activity(mock_db, Mock(), [{'grant_id': 'g1', 'funder_name': 'Funder A'}])
+    
+    assert mock_rebuild.called
+    assert not mock_update.called
+    assert stats['funders_refreshed'] == 2
+
+
+def test_rebuild_funder_contributions_deletes_stale_grants():
+    """Test that seeding writes every grant and removes contributions of deleted grants."""
+    mock_db = Mock()
+    grant_doc = Mock(id='g1')
+    grant_doc.to_dict.return_value = {'title': 'Grant', 'funder_name': 'Funder A', 'categories': ['x'],
+                                      'deadline_open': '2025-01-01', 'deadline_close': '2025-12-31'}
+    mock_db.collection.return_value.order_by.return_value.stream.return_value = [grant_doc]
+    mock_db.collection.return_value.document.return_value.collection.return_value.stream.return_value = []
+    stale_doc = Mock(id='deleted-grant')
+    stale_doc.to_dict.return_value = {'funder_name': 'Old Funder'}
+    mock_db.collection.return_value.stream.return_value = [stale_doc]
+    mock_db.get_all.return_value = []
+    
+    affected = rebuild_funder_contributions(mock_db)
+    
+    assert affected == {'Funder A', 'Old Funder'}
+    mock_db.batch.return_value.delete.assert_called_once_with(stale_doc.reference)
+    assert mock_db.batch.return_value.set.call_count == 1
+
+
+def test_plan_backfill_shards_uses_partition_cursors():
+    """Test that Firestore partitions become document-ID ranges."""
+    mock_db = Mock()
+    cursor_m, cursor_t = Mock(id='grant-m'), Mock(id='grant-t')
+    mock_db.collection_group.return_value.get_partitions.return_value = [
+        Mock(start_at=None, end_at=cursor_m),
+        Mock(start_at=cursor_m, end_at=cursor_t),
+        Mock(start_at=cursor_t, end_at=None),
+    ]
+    
+    shards = plan_backfill_shards(mock_db, 3)
+    
+    mock_db.collection_group.assert_called_with('grants')
+    assert shards == [(None, 'grant-m'), ('grant-m', 'grant-t'), ('grant-t', None)]
+
+
+def test_select_run_dispatches_on_mode():
+    """Test that ?mode= selects the incremental sync or a backfill."""
+    with patch('main.run_backfill', return_value=({}, 200)) as mock_backfill:
+        select_run(Mock(args={'mode': 'backfill', 'shards': '4', 'workers': '2'}))()
+    mock_backfill.assert_called_once_with(shard_count=4, workers=2, executor='process')
+    
+    with patch('main.run_sync', return_value=({}, 200)) as mock_sync:
+        select_run(Mock(args={}))()
+    assert mock_sync.called
+
+
+@pytest.mark.parametrize('args', [
+    {'shards': 'four'},
+    {'shards': '0'},
+    {'workers': '-1'},
+    {'executor': 'threads'},
+])
+def test_select_run_rejects_invalid_backfill_args(args):
+    """Test that bad backfill parameters return a 400 without starting a backfill."""
+    with patch('main.run_backfill') as mock_backfill:
+        body, status = select_run(Mock(args={'mode': 'backfill', **args}))()
+    
+    assert status == 400
+    assert body['status'] == 'error'
+    assert not mock_backfill.called
+
+
+@pytest.mark.parametrize('staging_table', [
+    'p.grants_warehouse.grants_flat',
+    'p.grants_warehouse.funders_activity',
+    'other.grants_warehouse.grants_flat_backfill_abc123',
+    'p.grants_warehouse.grants_flat_backfill_abc123; DROP',
+    None,
+])
+def test_backfill_shard_rejects_non_staging_tables(staging_table):
+    """Test that a shard request can only append to a backfill staging table."""
+    args = {'mode': 'backfill_shard', 'shard': '0'}
+    if staging_table:
+        args['staging_table'] = staging_table
+    with patch.dict(os.environ, {'GCP_PROJECT': 'p'}), patch('main.run_backfill_shard') as mock_shard:
+        body, status = run_backfill_shard_request(args)
+    
+    assert status == 400
+    assert not mock_shard.called
+
+
+def test_backfill_shard_accepts_staging_table():
+    """Test that a shard request for a real staging table runs the shard."""
+    args = {'staging_table': 'p.grants_warehouse.grants_flat_backfill_0f3a', 'shard': '2', 'start_id': 'grant-m'}
+    with patch.dict(os.environ, {'GCP_PROJECT': 'p'}), \
+            patch('main.run_backfill_shard', return_value={'shard': 2}) as mock_shard:
+        body, status = run_backfill_shard_request(args)
+    
+    assert status == 200
+    mock_shard.assert_called_once_with('p.grants_warehouse.grants_flat_backfill_0f3a', 2, 'grant-m', None)
+
+
+def shard_result(index, grants, funders):
+    return {
+        'shard': index, 'start_id': None, 'end_id': None, 'grants_synced': grants, 'denormalize_errors': 0,
+        'timings_ms': {}, 'counters': {'firestore_reads': grants, 'firestore_round_trips': 1},
+        'load_job': None, 'funders': funders, 'grant_ids': [f"grant-{index}-{i}" for i in range(grants)],
+    }
+
+
+def test_backfill_swaps_staging_table_after_all_shards():
+    """Test that a backfill swaps staging into grants_flat once and resets the watermark."""
+    shards = [(None, 'grant-m'), ('grant-m', None)]
+    deleted = Mock(id='grant-deleted')
+    deleted.to_dict.return_value = {'funder_name': 'Funder C'}
+    kept = Mock(id='grant-0-0')
+    kept.to_dict.return_value = {'funder_name': 'Funder A'}
+    with patch('main.firestore.Client') as mock_fs, patch('main.bigquery.Client') as mock_bq, \
+            patch('main.plan_backfill_shards', return_value=shards), \
+            patch('main.create_staging_table', return_value='p.grants_warehouse.grants_flat_backfill_x'), \
+            patch('main.acquire_backfill_lease', return_value=True), \
+            patch('main.release_backfill_lease') as mock_release, \
+            patch('main.invoke_backfill_shard', side_effect=[
+                shard_result(0, 10, ['Funder A']), shard_result(1, 5, ['Funder B'])
+            ]) as mock_invoke, \
+            patch('main.refresh_funders_activity', return_value={}) as mock_funders, \
+            patch('main.update_sync_time') as mock_update_sync:
+        db = mock_fs.return_value
+        db.collection.return_value.stream.return_value = [deleted, kept]
+        body, status = run_backfill(shard_count=2, workers=2, executor='fanout')
+    
+    assert status == 200
+    assert body['grants_synced'] == 15
+    assert mock_invoke.call_count == 2
+    
+    bq = mock_bq.return_value
+    bq.copy_table.assert_called_once()
+    assert bq.copy_table.call_args.args[0] == 'p.grants_warehouse.grants_flat_backfill_x'
+    bq.delete_table.assert_called_once_with('p.grants_warehouse.grants_flat_backfill_x', not_found_ok=True)
+    # Contributions of grants no shard returned are dropped; no serial rebuild
+    db.batch.return_value.delete.assert_called_once_with(deleted.reference)
+    assert mock_funders.call_args.kwargs['affected'] == {'Funder A', 'Funder B', 'Funder C'}
+    assert mock_funders.call_args.kwargs['contributions_complete'] is True
+    assert 'grant_ids' not in body['report']['shards'][0]
+    assert mock_update_sync.call_args.args[1].isoformat() == body['sync_time']
+    mock_release.assert_called_once_with(mock_fs.return_value, body['report']['run_id'])
+
+
+def test_backfill_does_not_swap_when_a_shard_fails():
+    """Test that a failed shard leaves grants_flat and the watermark untouched."""
+    with patch('main.firestore.Client'), patch('main.bigquery.Client') as mock_bq, \
+            patch('main.plan_backfill_shards', return_value=[(None, 'grant-m'), ('grant-m', None)]), \
+            patch('main.create_staging_table', return_value='p.grants_warehouse.grants_flat_backfill_y'), \
+            patch('main.acquire_backfill_lease', return_value=True), \
+            patch('main.release_backfill_lease') as mock_release, \
+            patch('main.invoke_backfill_shard', side_effect=[shard_result(0, 10, []), RuntimeError('shard 1 timed out')]), \
+            patch('main.update_sync_time') as mock_update_sync:
+        body, status = run_backfill(shard_count=2, workers=1, executor='fanout')
+    
+    assert status == 500
+    assert body['report']['status'] == 'error'
+    assert not mock_bq.return_value.copy_table.called
+    assert not mock_update_sync.called
+    mock_bq.return_value.delete_table.assert_called_once()
+    assert mock_release.called
+
+
+def test_backfill_funders_refresh_skips_serial_rebuild():
+    """Test that a backfill's first snapshot aggregates the shards' contributions without re-reading every grant."""
+    db = Mock()
+    db.collection.return_value.document.return_value.get.return_value.exists = False
+    contribution = Mock()
+    contribution.to_dict.return_value = {
+        'funder_name': 'Funder A', 'status': 'open', 'max_amount': 1000,
+        'deadline_close': '2099-01-01', 'created_at': '2025-01-01',
+    }
+    db.collection.return_value.where.return_value.stream.return_value = [contribution]
+    
+    with patch('main.rebuild_funder_contributions') as mock_rebuild:
+        stats = refresh_funders_activity(
+            db, Mock(), [], today=date(2025, 6, 1), affected={'Funder A'}, contributions_complete=True
+        )
+    
+    assert not mock_rebuild.called
+    assert stats == {'funders_refreshed': 1, 'funders_total': 1}
+
+
+def sync_metadata_doc(**fields):
+    """A metadata/sync snapshot with `fields`."""
+    doc = Mock(exists=True, update_time='t1')
+    doc.to_dict.return_value = {'last_sync_time': datetime(2025, 1, 1, tzinfo=timezone.utc), **fields}
+    return doc
+
+
+def test_sync_skips_while_backfill_holds_lease():
+    """Test that the hourly sync does nothing while a backfill holds the lease."""
+    lease = {'run_id': 'abc', 'expires_at': datetime(2999, 1, 1, tzinfo=timezone.utc)}
+    with patch('main.firestore.Client') as mock_fs, patch('main.bigquery.Client') as mock_bq, \
+            patch('main.fetch_modified_grants') as mock_fetch:
+        db = mock_fs.return_value
+        db.collection.return_value.document.return_value.get.return_value = sync_metadata_doc(backfill_lease=lease)
+        body, status = sync_to_bigquery(Mock(args={}))
+    
+    assert status == 200
+    assert body['status'] == 'skipped'
+    assert not mock_fetch.called
+    assert not db.collection.return_value.document.return_value.update.called
+
+
+def test_sync_ignores_expired_lease_and_guards_watermark():
+    """Test that an expired lease is ignored and the watermark write is conditional on the read."""
+    lease = {'run_id': 'abc', 'expires_at': datetime(2000, 1, 1, tzinfo=timezone.utc)}
+    with patch('main.firestore.Client') as mock_fs, patch('main.bigquery.Client'), \
+            patch('main.fetch_modified_grants', return_value=[]), \
+            patch('main.refresh_funders_activity', return_value={}):
+        db = mock_fs.return_value
+        sync_ref = db.collection.return_value.document.return_value
+        sync_ref.get.return_value = sync_metadata_doc(backfill_lease=lease)
+        body, status = sync_to_bigquery(Mock(args={}))
+    
+    assert body['status'] == 'success'
+    assert body['report']['watermark_written'] is True
+    db.write_option.assert_called_once_with(last_update_time='t1')
+    assert sync_ref.update.call_args.kwargs['option'] is db.write_option.return_value
+
+
+def test_sync_leaves_watermark_when_backfill_started_meanwhile():
+    """Test that a sync overlapping a backfill can't move the watermark past the backfill's start."""
+    from google.api_core.exceptions import FailedPrecondition
+    with patch('main.firestore.Client') as mock_fs, patch('main.bigquery.Client'), \
+            patch('main.fetch_modified_grants', return_value=[]), \
+            patch('main.refresh_funders_activity', return_value={}):
+        sync_ref = mock_fs.return_value.collection.return_value.document.return_value
+        sync_ref.get.return_value = sync_metadata_doc()
+        sync_ref.update.side_effect = FailedPrecondition('metadata/sync changed')
+        body, status = sync_to_bigquery(Mock(args={}))
+    
+    assert status == 200
+    assert body['report']['watermark_written'] is False
+
+
+def test_backfill_fails_when_lease_is_held():
+    """Test that a second backfill doesn't start while another holds the lease."""
+    with patch('main.firestore.Client'), patch('main.bigquery.Client'), \
+            patch('main.acquire_backfill_lease', return_value=False), \
+            patch('main.release_backfill_lease') as mock_release, \
+            patch('main.plan_backfill_shards') as mock_plan:
+        body, status = run_backfill(shard_count=2, workers=1, executor='process')
+    
+    assert status == 500
+    assert 'lease' in body['message']
+    assert not mock_plan.called
+    assert not mock_release.called
+
+
 if __name__ == '__main__':
     pytest.main([__file__, '-v'])